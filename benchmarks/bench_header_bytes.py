@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""Micro-benchmark: SRv6 header bytes per packet for typical leaf-spine paths"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from segment_list import compress_sid_list, encap_overhead
+
+BLOCK = 'fc00:0'
+FUNCTION = 'fe06'
+
+# Typical fabric paths as sequences of node uSIDs
+PATHS = {
+    'leaf-spine-leaf': ['1000', '2000', '1001'],
+    '5-stage clos': ['1000', '2000', '3000', '2001', '1001'],
+    'multi-pod (8 hops)': ['1000', '2000', '3000', '4000', '3001', '2001', '1001', '1002'],
+}
+
+def classic_sids(usids):
+    """One full SID per hop plus one for the destination function"""
+    return [f"{BLOCK}:{u}::" for u in usids] + [f"{BLOCK}:{usids[-1]}:{FUNCTION}::"]
+
+def per_hop_containers(usids):
+    """One uSID container per hop with the function in the last one"""
+    return [f"{BLOCK}:{u}::" for u in usids[:-1]] + [f"{BLOCK}:{usids[-1]}:{FUNCTION}::"]
+
+def main():
+    print(f"{'path':<22}{'classic':>10}{'per-hop':>10}{'dense':>10}{'dense+red':>11}{'segs':>6}")
+    for name, usids in PATHS.items():
+        dense = compress_sid_list([f"{BLOCK}:{u}::" for u in usids], FUNCTION)
+        row = (
+            encap_overhead(classic_sids(usids)),
+            encap_overhead(per_hop_containers(usids)),
+            encap_overhead(dense),
+            encap_overhead(dense, 'encap.red'),
+        )
+        print(f"{name:<22}{row[0]:>10}{row[1]:>10}{row[2]:>10}{row[3]:>11}{len(dense):>6}")
+
+    sids = [f"{BLOCK}:{u}::" for u in PATHS['multi-pod (8 hops)']]
+    runs = 20000
+    elapsed = timeit.timeit(lambda: compress_sid_list(sids, FUNCTION), number=runs)
+    print(f"\ncompress_sid_list (8 hops): {elapsed / runs * 1e6:.1f} us per call")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Benchmark: preparing routes from per-route API dicts vs. a RouteSet
+
+Both paths stop short of netlink and hand each route to a no-op sink, so
+the numbers are the Python overhead that sits in front of the kernel.
+"""
+import os
+import sys
+import time
+import ipaddress
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from segment_list import build_segment_list
+from route_table import RouteSet
+
+def make_responses(num_routes, num_vrfs, num_paths):
+    """Synthetic API responses: aggregate routes spread over VRFs, sharing a few paths"""
+    responses = []
+    for i in range(num_routes):
+        responses.append({
+            'found': True,
+            'destination_info': {
+                'prefix': f"2001:db8:{i // 65536:x}:{i % 65536:x}::",
+                'prefix_len': 64,
+                'ipv6_address': f"2001:db8:{i // 65536:x}:{i % 65536:x}::2"
+            },
+            'srv6_data': {
+                'srv6_usid': f"fc00:0:{1000 + i % num_paths:x}:{2000 + i % 7:x}::",
+                'srv6_endpoint_behavior': 0xfe06
+            },
+            'table_id': 1000 + i % num_vrfs
+        })
+    # Every route is requested twice, as happens with overlapping jobs
+    return responses + responses[:num_routes // 2]
+
+def per_dict_path(responses, sink):
+    """What program_all_routes + program_route do for each route today"""
+    seen = {}
+    for response in responses:
+        dest_info = response['destination_info']
+        srv6_data = response['srv6_data']
+        destination = f"{dest_info['prefix']}/{dest_info['prefix_len']}"
+        net = ipaddress.ip_network(destination)
+        segs = build_segment_list(srv6_data['srv6_usid'], srv6_data)
+        for seg in segs:
+            ipaddress.IPv6Address(seg)
+        encap = {'type': 'seg6', 'mode': 'encap', 'segs': segs[::-1]}
+        message = f"Adding route to {str(net)} with encap: {encap} to table {response['table_id']}"
+        seen[(response['table_id'], str(net))] = (segs, message)
+        sink(response['table_id'], str(net), encap)
+    return len(seen)
+
+def route_set_path(responses, sink):
+    """Build a RouteSet, validate and dedup it as arrays, then feed the sink"""
+    by_table = {}
+    for i, response in enumerate(responses):
+        by_table.setdefault(response['table_id'], {})[i] = response
+    sid_lists = peers = None
+    parts = []
+    for table_id, table_responses in by_table.items():
+        part = RouteSet.from_api_responses(table_responses, table_id=table_id, sid_lists=sid_lists, peers=peers)
+        sid_lists, peers = part.sid_lists, part.peers
+        parts.append(part.routes)
+    route_set = RouteSet(np.concatenate(parts), sid_lists, peers).valid().dedup()
+    for prefix, _, segs, table_id, _ in route_set:
+        sink(table_id, prefix, {'type': 'seg6', 'mode': 'encap', 'segs': segs[::-1]})
+    return len(route_set)
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--routes', type=int, default=50000)
+    parser.add_argument('--vrfs', type=int, default=16)
+    parser.add_argument('--paths', type=int, default=64)
+    args = parser.parse_args()
+
+    responses = make_responses(args.routes, args.vrfs, args.paths)
+    sink = lambda table_id, dst, encap: None
+
+    dict_count, dict_time = timed(per_dict_path, responses, sink)
+    set_count, set_time = timed(route_set_path, responses, sink)
+    assert dict_count == set_count, (dict_count, set_count)
+
+    print(f"{len(responses)} route requests, {dict_count} distinct routes, {args.vrfs} VRFs")
+    print(f"per-dict path: {dict_time * 1e3:8.1f} ms ({dict_time / len(responses) * 1e6:.2f} us/route)")
+    print(f"RouteSet path: {set_time * 1e3:8.1f} ms ({set_time / len(responses) * 1e6:.2f} us/route)")
+    print(f"speedup:       {dict_time / set_time:8.1f}x")
+
+    # Incremental update: diff two snapshots instead of reprogramming everything
+    old = RouteSet.from_api_responses(dict(enumerate(responses[:args.routes])))
+    changed_responses = dict(enumerate(responses[:args.routes]))
+    for i in range(0, args.routes, 100):
+        changed_responses[i] = dict(changed_responses[i], srv6_data={'srv6_usid': 'fc00:0:9999::'})
+    new = RouteSet.from_api_responses(changed_responses, sid_lists=old.sid_lists, peers=old.peers)
+    (added, removed, changed), diff_time = timed(lambda: old.dedup().diff(new.dedup()))
+    print(f"diff:          {diff_time * 1e3:8.1f} ms ({len(added)} added, {len(removed)} removed, "
+          f"{len(changed)} changed)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import logging
+import statistics
+import threading
+from collections import deque
+import torch
+import torch.distributed as dist
+from torch.distributed.algorithms.ddp_comm_hooks import default_hooks
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Point-to-point tags keeping probes and echoes apart when src == dst
+PROBE_TAG = 1
+ECHO_TAG = 2
+
+class PeerStats:
+    """Smoothed round-trip latency/bandwidth estimates towards one peer"""
+
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.samples = 0
+        self.latency = None
+        self.bandwidth = None
+        self.slow_streak = 0
+        self.slow_events = 0
+        self.reprograms = 0
+
+    def update(self, latency, bandwidth):
+        """Fold one probe result into the moving averages"""
+        self.samples += 1
+        if self.latency is None:
+            self.latency, self.bandwidth = latency, bandwidth
+        else:
+            self.latency += self.alpha * (latency - self.latency)
+            self.bandwidth += self.alpha * (bandwidth - self.bandwidth)
+
+    def reset(self):
+        """Forget estimates, e.g. after the route to the peer was reprogrammed"""
+        self.latency = None
+        self.bandwidth = None
+        self.slow_streak = 0
+
+class CommMonitor:
+    """Time collectives and probe peers to find slow fabric paths
+
+    Register comm_hook on the DDP model to time gradient buckets and call
+    step() once per training iteration. Every sample_every steps all ranks
+    exchange a small and a large tensor with probe_peers rotating peers;
+    peers whose bandwidth or latency stays well off the median for several
+    probes are reported to on_slow, which by default re-queries and
+    reprograms just their routes.
+
+    Each peer is measured once every ceil((world_size - 1) / probe_peers)
+    probes, so a persistently slow path is acted on after about
+    patience * ceil((world_size - 1) / probe_peers) * sample_every steps.
+    """
+
+    def __init__(self, nodes, network_programmer=None, sample_every=None, probe_bytes=None,
+                 slow_factor=None, patience=None, probe_peers=None, on_slow=None):
+        """Initialize with the job's nodes and, optionally, the programmer owning their routes"""
+        self.nodes = nodes
+        self.network_programmer = network_programmer
+        self.sample_every = sample_every or int(os.environ.get('COMM_MONITOR_SAMPLE_EVERY', '100'))
+        self.probe_bytes = probe_bytes or int(os.environ.get('COMM_MONITOR_PROBE_BYTES', str(1 << 20)))
+        self.slow_factor = slow_factor or float(os.environ.get('COMM_MONITOR_SLOW_FACTOR', '1.5'))
+        self.patience = patience or int(os.environ.get('COMM_MONITOR_PATIENCE', '3'))
+        self.probe_peers = probe_peers or int(os.environ.get('COMM_MONITOR_PROBE_PEERS', '8'))
+        self.on_slow = on_slow or self._reprogram
+        self.report_path = os.environ.get('COMM_MONITOR_REPORT')
+
+        self.rank = dist.get_rank()
+        self.world_size = dist.get_world_size()
+        self.hostnames = {node['rank']: node['hostname'] for node in nodes}
+        self.probe_peers = max(1, min(self.probe_peers, self.world_size - 1))
+        if self.world_size > 1:
+            rounds = -(-(self.world_size - 1) // self.probe_peers)
+            logger.info(f" Comm monitor: {self.probe_peers} peers per probe, each peer measured every "
+                        f"{rounds * self.sample_every} steps, slow paths acted on after about "
+                        f"{self.patience * rounds * self.sample_every} steps")
+
+        self.steps = 0
+        self.probes = 0
+        self.peers = {rank: PeerStats(alpha=0.3) for rank in range(self.world_size) if rank != self.rank}
+
+        self.bucket_calls = 0
+        self.bucket_times = deque(maxlen=1024)
+        self.bucket_bytes = 0
+
+        # NCCL only moves device tensors
+        self.nccl = dist.get_backend() == 'nccl'
+        device = torch.device('cuda', torch.cuda.current_device()) if self.nccl else torch.device('cpu')
+        self._small = torch.zeros(1, dtype=torch.uint8, device=device)
+        self._large = torch.zeros(self.probe_bytes, dtype=torch.uint8, device=device)
+
+    def comm_hook(self, state, bucket):
+        """DDP comm hook: allreduce the bucket, timing a sample of the calls"""
+        self.bucket_calls += 1
+        if self.bucket_calls % self.sample_every:
+            return default_hooks.allreduce_hook(state, bucket)
+
+        nbytes = bucket.buffer().numel() * bucket.buffer().element_size()
+        start = time.perf_counter()
+        future = default_hooks.allreduce_hook(state, bucket)
+
+        def record(fut):
+            self.bucket_times.append(time.perf_counter() - start)
+            self.bucket_bytes += nbytes
+            return fut.value()
+
+        return future.then(record)
+
+    def _echo(self, buf, src):
+        """Return src's probe to it, so src can time the round trip"""
+        dist.recv(buf, src, tag=PROBE_TAG)
+        dist.send(buf, src, tag=ECHO_TAG)
+
+    def _round_trip(self, tensor, dst, src):
+        """Send to dst and time until dst echoes it back, while echoing src's probe
+
+        Only a round trip is a network time on every backend: a Gloo send
+        completes once the bytes are in the local socket buffer.
+        """
+        recv_buf = torch.empty_like(tensor)
+        echo_buf = torch.empty_like(tensor)
+        if self.nccl:
+            # NCCL point-to-point ops complete on the GPU stream and are posted in
+            # two batches, so the time also includes src's first leg
+            torch.cuda.synchronize()
+            start = time.perf_counter()
+            for ops in ([dist.P2POp(dist.irecv, recv_buf, src), dist.P2POp(dist.isend, tensor, dst)],
+                        [dist.P2POp(dist.irecv, echo_buf, dst), dist.P2POp(dist.isend, recv_buf, src)]):
+                for req in dist.batch_isend_irecv(ops):
+                    req.wait()
+            torch.cuda.synchronize()
+            return time.perf_counter() - start
+
+        # Echo src from a helper thread so waiting for dst's echo never waits on src
+        echo = threading.Thread(target=self._echo, args=(recv_buf, src), daemon=True)
+        echo.start()
+        start = time.perf_counter()
+        echo_req = dist.irecv(echo_buf, dst, tag=ECHO_TAG)
+        send_req = dist.isend(tensor, dst, tag=PROBE_TAG)
+        echo_req.wait()
+        rtt = time.perf_counter() - start
+        send_req.wait()
+        echo.join()
+        return rtt
+
+    def probe(self):
+        """Probe the next probe_peers peer offsets; every rank must call this at the same step"""
+        if self.world_size < 2:
+            return
+        first = self.probes * self.probe_peers
+        self.probes += 1
+        for i in range(self.probe_peers):
+            offset = (first + i) % (self.world_size - 1) + 1
+            dst = (self.rank + offset) % self.world_size
+            src = (self.rank - offset) % self.world_size
+
+            # Warm up the connection, then time latency and bandwidth; the large
+            # probe crosses the path twice
+            self._round_trip(self._small, dst, src)
+            latency = self._round_trip(self._small, dst, src)
+            bandwidth = 2 * self.probe_bytes / self._round_trip(self._large, dst, src)
+
+            self.peers[dst].update(latency, bandwidth)
+            self._check(dst)
+
+    def _check(self, rank):
+        """Flag a peer that stays slower than its peers for patience probes"""
+        stats = self.peers[rank]
+        measured = [p for p in self.peers.values() if p.bandwidth is not None]
+        if len(measured) < 2:
+            return
+        median_bw = statistics.median(p.bandwidth for p in measured)
+        median_lat = statistics.median(p.latency for p in measured)
+
+        if stats.bandwidth * self.slow_factor < median_bw or stats.latency > median_lat * self.slow_factor:
+            stats.slow_streak += 1
+        else:
+            stats.slow_streak = 0
+
+        if stats.slow_streak >= self.patience:
+            stats.slow_events += 1
+            hostname = self.hostnames.get(rank)
+            logger.warning(f"Path to rank {rank} ({hostname}) is persistently slow: "
+                           f"{stats.bandwidth / 1e6:.1f} MB/s vs median {median_bw / 1e6:.1f} MB/s, "
+                           f"{stats.latency * 1e3:.2f} ms vs median {median_lat * 1e3:.2f} ms")
+            if self.on_slow([hostname]):
+                stats.reprograms += 1
+            stats.reset()
+
+    def _reprogram(self, hostnames):
+        """Re-query and reprogram the routes to the given peers"""
+        if not self.network_programmer:
+            return False
+        return self.network_programmer.reprogram_peers(self.nodes, hostnames)
+
+    def step(self):
+        """Call once per training iteration, outside the backward pass"""
+        self.steps += 1
+        if self.steps % self.sample_every == 0:
+            self.probe()
+
+    def report(self):
+        """Summarize per-peer estimates and collective timings"""
+        def peer_report(stats):
+            return {
+                'samples': stats.samples,
+                'latency_ms': stats.latency * 1e3 if stats.latency is not None else None,
+                'bandwidth_mbps': stats.bandwidth * 8 / 1e6 if stats.bandwidth is not None else None,
+                'slow_events': stats.slow_events,
+                'reprograms': stats.reprograms
+            }
+
+        times = sorted(self.bucket_times)
+        return {
+            'rank': self.rank,
+            'steps': self.steps,
+            'probes': self.probes,
+            'buckets': {
+                'calls': self.bucket_calls,
+                'sampled': len(times),
+                'mean_ms': statistics.mean(times) * 1e3 if times else None,
+                'p95_ms': times[int(len(times) * 0.95)] * 1e3 if times else None,
+                'sampled_bytes': self.bucket_bytes
+            },
+            'peers': {self.hostnames.get(r, str(r)): peer_report(s) for r, s in self.peers.items()}
+        }
+
+    def close(self):
+        """Log the end-of-job report and write it to COMM_MONITOR_REPORT if set"""
+        report = self.report()
+        slow = {h: p for h, p in report['peers'].items() if p['slow_events']}
+        logger.info(f" Comm monitor: {report['probes']} probes over {report['steps']} steps, "
+                    f"{len(slow)} slow peers {sorted(slow)}")
+        if self.report_path:
+            try:
+                with open(self.report_path, 'w') as f:
+                    json.dump(report, f, indent=2)
+            except Exception as e:
+                logger.error(f"Failed to write comm monitor report to {self.report_path}: {e}")
+        return report
@@ -1,30 +1,75 @@
 import os
+import json
+import struct
 import logging
+import ipaddress
 import requests
 from route_programmer import RouteProgrammerFactory
+from segment_list import build_segment_list
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class NetworkProgrammer:
-    def __init__(self, api_endpoint):
-        """Initialize with the network API endpoint"""
+    def __init__(self, api_endpoint, program_routes=True):
+        """Initialize with the network API endpoint
+        
+        With program_routes=False only the API side is used (e.g. to compile
+        route plans offline) and no route programmer is created.
+        """
         self.api_endpoint = api_endpoint
         self.collection_name = os.environ.get('TOPOLOGY_COLLECTION', 'network_topology')
         
-        # Initialize route programmer - default to Linux
+        # Initialize route programmer - the node-local route agent if one is
+        # configured, otherwise default to Linux
+        self.route_programmer = None
+        self.route_agent = None
         platform = os.environ.get('ROUTE_PLATFORM', 'linux')
+        agent_socket = os.environ.get('ROUTE_AGENT_SOCKET')
+        if program_routes and agent_socket:
+            try:
+                from route_agent import RouteAgentClient
+                self.route_agent = RouteAgentClient(agent_socket)
+                self.route_programmer = self.route_agent
+            except Exception as e:
+                logger.warning(f"Route agent at {agent_socket} unavailable, programming routes locally: {e}")
         try:
-            self.route_programmer = RouteProgrammerFactory.get_programmer(platform)
+            if program_routes and not self.route_programmer:
+                self.route_programmer = RouteProgrammerFactory.get_programmer(platform)
             #logger.info(f"Initialized {platform} route programmer")
         except Exception as e:
             logger.error(f"Failed to initialize route programmer: {e}")
             logger.warning("Route programming will be disabled")
-            self.route_programmer = None
+        
+        # peer hostname -> installed route ({'prefix', 'srv6_data', 'ip_address'}),
+        # persisted to ROUTE_STATE_FILE so a restarted worker knows what it installed
+        self.state_path = os.environ.get('ROUTE_STATE_FILE') if program_routes else None
+        self.installed_routes = self._load_state()
+        
+        # Optional per-peer traffic collector (disabled unless an interval is set)
+        self.traffic_collector = None
+        interval = float(os.environ.get('TRAFFIC_COLLECTOR_INTERVAL', '0'))
+        if program_routes and interval > 0:
+            try:
+                from traffic_collector import TrafficCollector
+                self.traffic_collector = TrafficCollector(
+                    interface=os.environ.get('BACKEND_INTERFACE', 'eth1'),
+                    table_id=int(os.environ.get('ROUTE_TABLE_ID', '254')),
+                    interval=interval
+                )
+            except Exception as e:
+                logger.error(f"Failed to initialize traffic collector: {e}")
     
-    def get_route_info(self, source, destination):
-        """Get route information from the API"""
+    def get_route_info(self, source, destination, refresh=False):
+        """Get route information from the API; refresh bypasses the route agent's cache"""
+        if self.route_agent:
+            # Shared with the other jobs on this host through the agent's cache
+            try:
+                return self.route_agent.get_route_info(source, destination, refresh=refresh)
+            except Exception as e:
+                logger.error(f"Route agent lookup failed for {source} -> {destination}: {e}")
+                return None
         try:
             # logger.info(f"Calling network API for {source} -> {destination}")
             url = f"{self.api_endpoint}/graphs/{self.collection_name}/shortest_path/load"
@@ -46,8 +91,13 @@ class NetworkProgrammer:
             logger.error(f"Network API call failed for {source} -> {destination}: {e}")
             return None
     
-    def program_route(self, destination, srv6_data, interface='eth1'):
-        """Program an SRv6 route"""
+    def program_route(self, destination, srv6_data, interface='eth1', segs=None, refresh=False):
+        """Program an SRv6 route; segs, if given, is a precomputed segment list
+        
+        refresh marks a reprogrammed path: the live route is replaced in
+        place rather than deleted and re-added, and it may replace a route
+        that other jobs on this host share through the route agent.
+        """
         if not self.route_programmer:
             logger.error("Route programmer not initialized, cannot program route")
             return False
@@ -61,7 +111,11 @@ class NetworkProgrammer:
             # Program the route
             success, message = self.route_programmer.program_route(
                 destination_prefix=destination,
-                srv6_usid=srv6_data['srv6_usid'],
+                srv6_usid=srv6_data.get('srv6_usid'),
+                srv6_data=srv6_data,
+                segs=segs,
+                refresh=refresh,
+                replace=refresh,
                 outbound_interface=interface,
                 table_id=int(os.environ.get('ROUTE_TABLE_ID', '254'))
             )
@@ -76,74 +130,377 @@ class NetworkProgrammer:
             logger.error(f"Exception during route programming: {e}")
             return False
     
-    def program_all_routes(self, nodes):
-        """Program routes for all node pairs"""
+    def delete_route(self, destination):
+        """Withdraw an SRv6 route"""
         if not self.route_programmer:
-            logger.error("Route programmer not initialized, cannot program routes")
+            logger.error("Route programmer not initialized, cannot delete route")
             return False
         
-        # Get current node's hostname
+        try:
+            logger.info(f"  Withdrawing route to {destination}")
+            success, message = self.route_programmer.delete_route(
+                destination_prefix=destination,
+                table_id=int(os.environ.get('ROUTE_TABLE_ID', '254'))
+            )
+            if not success:
+                logger.warning(message)
+            return success
+        except Exception as e:
+            logger.error(f"Exception during route deletion: {e}")
+            return False
+    
+    def _get_current_host(self, nodes):
+        """Find the current node's hostname in the nodes list"""
         rank = int(os.environ.get('RANK', '0'))
-        current_host = None
-        
-        # Find the current node's hostname from the nodes list
         for node in nodes:
             if node['rank'] == rank:
-                current_host = f"hosts/{node['hostname']}"
-                break
+                return node['hostname']
+        logger.error(f"Could not find hostname for rank {rank}")
+        return None
+    
+    def resolve_peer(self, source, destination, api_response=None, refresh=False):
+        """Query the API (unless a response is given) and return the peer's (prefix, srv6_data), or None"""
+        if api_response is None:
+            api_response = self.get_route_info(source, destination, refresh=refresh)
+        if not api_response or not api_response.get('found'):
+            logger.warning(f"No route found for {source} -> {destination}")
+            return None
+        
+        srv6_data = api_response.get('srv6_data', {})
+        if not srv6_data:
+            logger.warning(f"No SRv6 data found in API response for {destination}")
+            return None
+        
+        # Extract destination network from the API response
+        dest_info = api_response.get('destination_info', {})
+        if not dest_info or 'prefix' not in dest_info or 'prefix_len' not in dest_info:
+            logger.warning(f"No prefix information found for {destination}")
+            return None
+        
+        # Determine IP version from MASTER_ADDR
+        master_addr = os.environ.get('MASTER_ADDR', '')
+        is_ipv6 = ':' in master_addr
+        
+        # Use the appropriate prefix and prefix_len from the API response
+        if is_ipv6 and not dest_info.get('ipv6_address'):
+            logger.warning(f"No IPv6 address found for {destination}")
+            return None
+        if not is_ipv6 and not dest_info.get('ipv4_address'):
+            logger.warning(f"No IPv4 address found for {destination}")
+            return None
+        
+        return f"{dest_info['prefix']}/{dest_info['prefix_len']}", srv6_data
+    
+    def _load_state(self):
+        """Load the installed routes recorded by a previous worker on this host"""
+        if not self.state_path or not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring route state file {self.state_path}: {e}")
+            return {}
+    
+    def _save_state(self):
+        """Record the installed routes in ROUTE_STATE_FILE, if set"""
+        if not self.state_path:
+            return
+        try:
+            tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.installed_routes, f)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            logger.warning(f"Failed to write route state file {self.state_path}: {e}")
+    
+    def _prefix_in_use(self, prefix, hostname, nodes=None):
+        """Check whether a prefix still routes to a peer other than hostname
+        
+        Several peers can share one prefix (e.g. hosts on the same subnet), so
+        a route is only withdrawn once no other installed peer, and no other
+        current node's address, falls under it.
+        """
+        if any(route['prefix'] == prefix for peer, route in self.installed_routes.items() if peer != hostname):
+            return True
+        try:
+            net = ipaddress.ip_network(prefix, strict=False)
+        except ValueError:
+            return False
+        rank = int(os.environ.get('RANK', '0'))
+        for node in nodes or []:
+            if node['hostname'] == hostname or node.get('rank') == rank or not node.get('ip_address'):
+                continue
+            try:
+                if ipaddress.ip_address(node['ip_address']) in net:
+                    return True
+            except ValueError:
+                continue
+        return False
+    
+    def _release_prefix(self, prefix, hostname, nodes=None):
+        """Withdraw a peer's prefix unless another peer still uses it"""
+        if self._prefix_in_use(prefix, hostname, nodes):
+            logger.info(f"  Keeping route to {prefix}, still used by other peers")
+            return True
+        return self.delete_route(prefix)
+    
+    def _program_peer(self, current_host, node, nodes=None, refresh=False):
+        """Resolve and program the route to one peer, recording it if installed
+        
+        With refresh the path is re-queried rather than taken from a cache.
+        """
+        destination = f"hosts/{node['hostname']}"
+        try:
+            resolved = self.resolve_peer(f"hosts/{current_host}", destination, refresh=refresh)
+            if not resolved:
+                return False
+            dest_ip, srv6_data = resolved
+            
+            if not self.program_route(
+                destination=dest_ip,
+                srv6_data=srv6_data,
+                interface=os.environ.get('BACKEND_INTERFACE', 'eth1'),
+                refresh=refresh
+            ):
+                return False
+            
+            # The peer may have moved to another prefix
+            previous = self.installed_routes.get(node['hostname'])
+            self.installed_routes[node['hostname']] = {
+                'prefix': dest_ip,
+                'srv6_data': srv6_data,
+                'ip_address': node.get('ip_address')
+            }
+            if previous and previous['prefix'] != dest_ip:
+                self._release_prefix(previous['prefix'], node['hostname'], nodes)
+            return True
+        except Exception as e:
+            logger.error(f"Error programming route to {destination}: {e}")
+            return False
+    
+    def _withdraw_peer(self, hostname, current_host=None, nodes=None):
+        """Withdraw the route to a departed peer
+        
+        A peer this process did not install itself (e.g. after a worker
+        restart without ROUTE_STATE_FILE) is resolved through the API to find
+        its prefix.
+        """
+        route = self.installed_routes.pop(hostname, None)
+        if route:
+            prefix = route['prefix']
+        else:
+            resolved = self.resolve_peer(f"hosts/{current_host}", f"hosts/{hostname}") if current_host else None
+            if not resolved:
+                logger.warning(f"Cannot find the route to departed peer {hostname}, leaving it in place")
+                return False
+            prefix = resolved[0]
+        return self._release_prefix(prefix, hostname, nodes)
+    
+    def _withdraw_departed(self, current_host, nodes):
+        """Withdraw recorded routes to peers that are no longer in nodes (e.g. loaded from ROUTE_STATE_FILE)"""
+        hostnames = {node['hostname'] for node in nodes}
+        for hostname in [h for h in self.installed_routes if h not in hostnames or h == current_host]:
+            self._withdraw_peer(hostname, current_host, nodes)
+    
+    def _program_route_set(self, routes, nodes=None):
+        """Program many peers' routes as one RouteSet, recording the ones installed
+        
+        routes is a list of {'hostname', 'prefix', 'segs', 'srv6_data'}.
+        """
+        from route_table import RouteSet
+        table_id = int(os.environ.get('ROUTE_TABLE_ID', '254'))
+        route_set = RouteSet.from_routes((route['prefix'], route['segs'], table_id, route['hostname'])
+                                         for route in routes)
+        failed = []
+        success, message = self.route_programmer.program_route_set(
+            route_set, failed=failed, outbound_interface=os.environ.get('BACKEND_INTERFACE', 'eth1'))
+        if not success:
+            logger.warning(message)
+        
+        failed = set(failed)
+        ip_addresses = {node['hostname']: node.get('ip_address') for node in nodes or []}
+        for route in routes:
+            hostname = route['hostname']
+            if hostname in failed:
+                logger.warning(f"Failed to program route to {hostname} ({route['prefix']})")
+                continue
+            # The peer may have moved to another prefix
+            previous = self.installed_routes.get(hostname)
+            self.installed_routes[hostname] = {
+                'prefix': route['prefix'],
+                'srv6_data': route['srv6_data'],
+                'ip_address': ip_addresses.get(hostname)
+            }
+            if previous and previous['prefix'] != route['prefix']:
+                self._release_prefix(previous['prefix'], hostname, nodes)
+        return success
+    
+    def _by_demand(self, peers):
+        """Order peers by measured demand, heaviest first, so they are (re)programmed first"""
+        if not self.traffic_collector:
+            return peers
+        demand = self.traffic_collector.demand()
+        return sorted(peers, key=lambda node: demand.get(node['hostname'], 0.0), reverse=True)
+    
+    def _sync_traffic_collector(self):
+        """Point the traffic collector at the currently installed routes"""
+        if self.traffic_collector:
+            self.traffic_collector.set_peers(
+                {route['prefix']: hostname for hostname, route in self.installed_routes.items()}
+            )
+    
+    def reprogram_peers(self, nodes, hostnames):
+        """Re-query the API and reprogram the routes to just these peers"""
+        if not self.route_programmer:
+            logger.error("Route programmer not initialized, cannot reprogram routes")
+            return False
+        
+        current_host = self._get_current_host(nodes)
+        if not current_host:
+            return False
+        
+        peers = [node for node in nodes if node['hostname'] in hostnames and node['hostname'] != current_host]
+        peers = self._by_demand(peers)
+        success = bool(peers)
+        for node in peers:
+            logger.info(f" Reprogramming route to {node['hostname']}")
+            success = self._program_peer(current_host, node, nodes, refresh=True) and success
+        
+        self._save_state()
+        self._sync_traffic_collector()
+        return success
+    
+    def program_all_routes(self, nodes):
+        """Program routes for all node pairs"""
+        if not self.route_programmer:
+            logger.error("Route programmer not initialized, cannot program routes")
+            return False
         
+        current_host = self._get_current_host(nodes)
         if not current_host:
-            logger.error(f"Could not find hostname for rank {rank}")
             return False
         
+        self._withdraw_departed(current_host, nodes)
+        
         # Only generate routes from current host to other nodes
-        all_pairs = []
-        for node in nodes:
-            if node['rank'] != rank:  # Skip self
-                all_pairs.append({
-                    'source': current_host,
-                    'destination': f"hosts/{node['hostname']}"
-                })
-        
-        # Program one route per destination
-        for pair in all_pairs:
-            api_response = self.get_route_info(pair['source'], pair['destination'])
-            if api_response and api_response.get('found'):
-                srv6_data = api_response.get('srv6_data', {})
-                if srv6_data:
-                    # Extract destination network from the API response
-                    dest_info = api_response.get('destination_info', {})
-                    if not dest_info or 'prefix' not in dest_info or 'prefix_len' not in dest_info:
-                        logger.warning(f"No prefix information found for {pair['destination']}")
-                        continue
-                    
-                    # Determine IP version from MASTER_ADDR
-                    master_addr = os.environ.get('MASTER_ADDR', '')
-                    is_ipv6 = ':' in master_addr
-                    
-                    # Use the appropriate prefix and prefix_len from the API response
-                    if is_ipv6:
-                        if not dest_info.get('ipv6_address'):
-                            logger.warning(f"No IPv6 address found for {pair['destination']}")
-                            continue
-                        dest_ip = f"{dest_info['prefix']}/{dest_info['prefix_len']}"
-                    else:
-                        if not dest_info.get('ipv4_address'):
-                            logger.warning(f"No IPv4 address found for {pair['destination']}")
-                            continue
-                        dest_ip = f"{dest_info['prefix']}/{dest_info['prefix_len']}"
-                    
-                    try:
-                        self.program_route(
-                            destination=dest_ip,
-                            srv6_data=srv6_data,
-                            interface=os.environ.get('BACKEND_INTERFACE', 'eth1')
-                        )
-                    except Exception as e:
-                        logger.error(f"Error programming route to {pair['destination']}: {e}")
-                else:
-                    logger.warning(f"No SRv6 data found in API response for {pair['destination']}")
-            else:
-                logger.warning(f"No route found for {pair['source']} -> {pair['destination']}")
-        
-        return True 
\ No newline at end of file
+        peers = [node for node in nodes if node['hostname'] != current_host]
+        
+        # Use measured demand, if any (e.g. when called again later), to program the heaviest peers first
+        peers = self._by_demand(peers)
+        
+        # Resolve one route per destination, then program them all in one pass
+        routes = []
+        for node in peers:
+            resolved = self.resolve_peer(f"hosts/{current_host}", f"hosts/{node['hostname']}")
+            if not resolved:
+                continue
+            prefix, srv6_data = resolved
+            try:
+                ipaddress.ip_network(prefix, strict=False)
+                segs = build_segment_list(srv6_data.get('srv6_usid'), srv6_data)
+            except ValueError as e:
+                logger.error(f"Invalid route to {node['hostname']}: {e}")
+                continue
+            routes.append({'hostname': node['hostname'], 'prefix': prefix, 'segs': segs, 'srv6_data': srv6_data})
+        if routes:
+            self._program_route_set(routes, nodes)
+        
+        self._save_state()
+        self._sync_traffic_collector()
+        return True
+    
+    def program_from_plan(self, plan_path, nodes):
+        """Program this rank's routes from a precompiled route plan, without API calls
+        
+        Returns False if the plan is missing, corrupt or stale, so the caller
+        can fall back to program_all_routes. Peers the plan has no route for
+        (the compiler found no path when it ran) are resolved through the API.
+        """
+        if not self.route_programmer:
+            logger.error("Route programmer not initialized, cannot program routes")
+            return False
+        
+        from route_plan import RoutePlan, StalePlanError
+        try:
+            plan = RoutePlan(plan_path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Cannot use route plan {plan_path}: {e}")
+            return False
+        
+        try:
+            max_age = os.environ.get('ROUTE_PLAN_MAX_AGE')
+            plan.validate(nodes,
+                          topology_version=os.environ.get('ROUTE_PLAN_TOPOLOGY_VERSION'),
+                          max_age=float(max_age) if max_age else None)
+            routes = plan.routes_for_rank(int(os.environ.get('RANK', '0')))
+        except StalePlanError as e:
+            logger.warning(f"Route plan {plan_path} is stale: {e}")
+            return False
+        except (ValueError, struct.error) as e:
+            logger.warning(f"Cannot use route plan {plan_path}: {e}")
+            return False
+        finally:
+            plan.close()
+        
+        logger.info(f" Programming {len(routes)} routes from plan (topology version {plan.topology_version})")
+        if routes:
+            self._program_route_set([dict(route, srv6_data={'segs': route['segs']}) for route in routes], nodes)
+        
+        current_host = self._get_current_host(nodes)
+        if current_host:
+            self._withdraw_departed(current_host, nodes)
+        planned = {route['hostname'] for route in routes}
+        missing = [node for node in nodes if node['hostname'] != current_host and node['hostname'] not in planned]
+        if current_host and missing:
+            logger.info(f" Resolving {len(missing)} peers missing from the plan through the API")
+            for node in missing:
+                self._program_peer(current_host, node, nodes)
+        
+        self._save_state()
+        self._sync_traffic_collector()
+        return True
+    
+    def update_routes(self, previous_nodes, current_nodes):
+        """Incrementally update routes after a membership change
+        
+        Routes are resolved and installed only for peers that joined (or whose
+        address changed) and withdrawn for peers that left; routes to unchanged
+        peers are left in place. Peers are known from previous_nodes and from
+        the routes this worker (or, with ROUTE_STATE_FILE, its predecessor)
+        installed, so a restarted worker does not reprogram every peer.
+        """
+        if not self.route_programmer:
+            logger.error("Route programmer not initialized, cannot update routes")
+            return False
+        
+        current_host = self._get_current_host(current_nodes)
+        if not current_host:
+            return False
+        
+        # Ranks are reassigned on rescale, so peers are keyed by hostname
+        known = {hostname: {'hostname': hostname, 'ip_address': route.get('ip_address')}
+                 for hostname, route in self.installed_routes.items()}
+        known.update({node['hostname']: node for node in previous_nodes or []})
+        known.pop(current_host, None)
+        current = {node['hostname']: node for node in current_nodes if node['hostname'] != current_host}
+        
+        def address_changed(node):
+            previous_ip = known[node['hostname']].get('ip_address')
+            return bool(previous_ip and node.get('ip_address') and previous_ip != node['ip_address'])
+        
+        departed = [hostname for hostname in known if hostname not in current]
+        joined = [node for hostname, node in current.items() if hostname not in known or address_changed(node)]
+        joined = self._by_demand(joined)
+        
+        logger.info(f" Membership change: {len(joined)} new, {len(departed)} departed, "
+                    f"{len(current) - len(joined)} unchanged peers")
+        
+        for hostname in departed:
+            self._withdraw_peer(hostname, current_host, current_nodes)
+        for node in joined:
+            self._program_peer(current_host, node, current_nodes)
+        
+        self._save_state()
+        self._sync_traffic_collector()
+        return True
@@ -0,0 +1,77 @@
+#!/bin/bash
+# Compare iperf3 over an SRv6 encap route with and without MTU/advmss accounting.
+#
+#   [a] --(mtu 9000)-- [r] --(mtu 1500)-- [b]
+#
+# a encapsulates traffic to 2001:db8:b::1 towards SID fc00:b::100, which b
+# decapsulates (End.DT6). The fabric link r-b is smaller than a's interface,
+# so without the route metrics the first large segments are dropped at r and
+# recovered through PMTU discovery.
+#
+# Requires root, iproute2 and iperf3. Run from the repository root.
+set -e
+
+SID=fc00:b::100
+DST=2001:db8:b::1
+SRC=2001:db8:a::1
+HOST_MTU=9000
+PATH_MTU=1500
+DURATION=${DURATION:-5}
+
+cleanup() {
+    for ns in a r b; do ip netns del $ns 2>/dev/null || true; done
+}
+trap cleanup EXIT
+cleanup
+
+for ns in a r b; do
+    ip netns add $ns
+    ip -n $ns link set lo up
+done
+
+ip link add a0 netns a type veth peer name r0 netns r
+ip link add r1 netns r type veth peer name b0 netns b
+ip -n a link set a0 mtu $HOST_MTU up
+ip -n r link set r0 mtu $HOST_MTU up
+ip -n r link set r1 mtu $PATH_MTU up
+ip -n b link set b0 mtu $PATH_MTU up
+
+ip -n a -6 addr add fc00:ab::1/64 dev a0 nodad
+ip -n r -6 addr add fc00:ab::2/64 dev r0 nodad
+ip -n r -6 addr add fc00:bb::1/64 dev r1 nodad
+ip -n b -6 addr add fc00:bb::2/64 dev b0 nodad
+ip -n a -6 addr add $SRC/128 dev lo
+ip -n b -6 addr add $DST/128 dev lo
+
+ip netns exec r sysctl -qw net.ipv6.conf.all.forwarding=1
+ip netns exec b sysctl -qw net.ipv6.conf.all.seg6_enabled=1
+ip netns exec b sysctl -qw net.ipv6.conf.b0.seg6_enabled=1
+
+ip -n a -6 route add fc00:b::/48 via fc00:ab::2
+ip -n r -6 route add fc00:b::/48 via fc00:bb::2
+ip -n r -6 route add 2001:db8:a::/48 via fc00:ab::1
+ip -n b -6 route add 2001:db8:a::/48 via fc00:bb::1
+ip -n b -6 route add $SID/128 encap seg6local action End.DT6 table 254 dev b0
+
+ip netns exec b iperf3 -s -D -B $DST
+sleep 1
+
+# Same numbers the plugin computes when programming the route
+ADVMSS=$(SRV6_PATH_MTU=$PATH_MTU python3 -c "
+from segment_list import route_advmss
+print(route_advmss($PATH_MTU, ['$SID']))")
+
+run() {
+    ip -n a -6 route flush cache
+    ip netns exec r nstat -n
+    echo "== $1"
+    ip -n a -6 route show $DST
+    ip netns exec a iperf3 -6 -c $DST -B $SRC -t $DURATION | grep -E "sender|receiver"
+    ip netns exec r nstat -a Icmp6OutPktTooBigs | tail -n +2 || true
+}
+
+ip -n a -6 route add $DST/128 encap seg6 mode encap segs $SID dev a0
+run "without MTU accounting"
+
+ip -n a -6 route replace $DST/128 encap seg6 mode encap segs $SID dev a0 mtu $PATH_MTU advmss $ADVMSS
+run "with MTU accounting (mtu $PATH_MTU advmss $ADVMSS)"
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""Node-local route agent shared by all jobs on a host
+
+The agent owns the route programmer (and its netlink socket) and an API
+cache. Jobs send route requests over a Unix socket; identical requests
+from different jobs are deduplicated, routes are reference counted so one
+job's teardown does not remove a route another job still uses, and route
+operations are coalesced and applied in batches.
+
+Protocol: one JSON object per line in each direction.
+    {"op": "hello", "job": id}
+    {"op": "route_info", "source": ..., "destination": ..., "refresh": bool}
+    {"op": "acquire", "prefix": ..., "srv6_data": {...}, "segs": [...],
+     "interface": ..., "table_id": ..., "refresh": bool}
+    {"op": "release", "prefix": ..., "table_id": ...}
+    {"op": "status"}
+Routes held by a connection are released when it closes. refresh bypasses
+the API cache (route_info) or allows changing the path of a route other
+jobs share (acquire), for reprogramming a path found to be slow.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import itertools
+import threading
+import socketserver
+
+from route_programmer import RouteProgrammer, RouteProgrammerFactory
+from segment_list import build_segment_list
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = '/run/srv6-route-agent.sock'
+
+class RouteAgent:
+    """Deduplicating, reference-counting owner of the host's SRv6 routes"""
+
+    def __init__(self, api_endpoint, platform=None, cache_ttl=None, batch_interval=None):
+        """Initialize with the network API endpoint and the route platform"""
+        from controller import NetworkProgrammer
+        self.api = NetworkProgrammer(api_endpoint, program_routes=False)
+        self.route_programmer = RouteProgrammerFactory.get_programmer(
+            platform or os.environ.get('ROUTE_PLATFORM', 'linux'))
+        self.cache_ttl = cache_ttl or float(os.environ.get('ROUTE_AGENT_CACHE_TTL', '300'))
+        self.batch_interval = batch_interval or float(os.environ.get('ROUTE_AGENT_BATCH_MS', '20')) / 1000
+
+        # (source, destination) -> (timestamp, API response)
+        self.api_cache = {}
+        self.api_calls = 0
+        # (table_id, prefix) -> {'srv6_data', 'segs', 'interface', 'holders', 'jobs'}
+        self.routes = {}
+        # (table_id, prefix) -> ('add', route) | ('del', None), applied by the batch worker
+        self.pending = {}
+        # Latest result per route key, and batch generations flushed/next to flush
+        self.results = {}
+        self.generation = 0
+        self.next_generation = 1
+        self.netlink_ops = 0
+
+        self.lock = threading.Lock()
+        self.flushed = threading.Condition(self.lock)
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.worker = threading.Thread(target=self._run, name='route-agent-batch', daemon=True)
+        self.worker.start()
+
+    def get_route_info(self, source, destination, refresh=False):
+        """API lookup shared by all jobs on this host; refresh bypasses the cache"""
+        key = (source, destination)
+        with self.lock:
+            cached = self.api_cache.get(key)
+        if cached and not refresh and time.time() - cached[0] < self.cache_ttl:
+            return cached[1]
+
+        data = self.api.get_route_info(source, destination)
+        if data is not None:
+            with self.lock:
+                self.api_calls += 1
+                self.api_cache[key] = (time.time(), data)
+        return data
+
+    def _enqueue(self, key, op, route=None):
+        """Queue an operation and return the generation of the batch that applies it"""
+        self.pending[key] = (op, route)
+        self.wakeup.set()
+        return self.next_generation
+
+    def _wait(self, key, generation):
+        """Wait for the batch containing this operation; lock must be held"""
+        while self.generation < generation:
+            self.flushed.wait()
+        return self.results.get(key, (True, "No change"))
+
+    def acquire(self, holder, job, prefix, srv6_data, segs, interface, table_id, refresh=False):
+        """Take a reference on a route, programming it if it is new or changed
+
+        A different path for a route other holders share is rejected, leaving
+        their route in place, unless refresh is set: the path was re-queried
+        from the API and replaces the route for every holder.
+        """
+        key = (table_id, prefix)
+        # Compare what would be programmed, not how the job described it
+        # (API data vs a precompiled segment list)
+        try:
+            segs = list(segs) if segs else build_segment_list(srv6_data.get('srv6_usid'), srv6_data)
+        except ValueError as e:
+            return False, f"Invalid segment list for {prefix}: {e}"
+        with self.lock:
+            route = self.routes.get(key)
+            if route and route['segs'] == segs and route['interface'] == interface:
+                # Identical request from another job: just take a reference
+                route['holders'].add(holder)
+                route['jobs'].add(job)
+                if key not in self.pending:
+                    return True, f"Route to {prefix} shared by {len(route['holders'])} holders"
+                return self._wait(key, self.next_generation)
+
+            if route and not refresh and route['holders'] - {holder}:
+                return False, (f"Route to {prefix} is held by {len(route['holders'] - {holder})} other holders "
+                               f"with a different path")
+            if route:
+                logger.info(f"Job {job} changes the path to {prefix}, reprogramming for all holders")
+                holders, jobs = route['holders'], route['jobs']
+            else:
+                holders, jobs = set(), set()
+            holders.add(holder)
+            jobs.add(job)
+            # A route already installed is replaced in place so it never goes missing
+            route = {'srv6_data': srv6_data, 'segs': segs, 'interface': interface,
+                     'holders': holders, 'jobs': jobs, 'replace': key in self.routes}
+            self.routes[key] = route
+            generation = self._enqueue(key, 'add', route)
+            return self._wait(key, generation)
+
+    def _release_locked(self, holder, key):
+        """Drop a reference; return the batch generation to wait for, or a result"""
+        route = self.routes.get(key)
+        if not route or holder not in route['holders']:
+            return None, (False, f"Route to {key[1]} not held")
+        route['holders'].discard(holder)
+        if route['holders']:
+            return None, (True, f"Route to {key[1]} still used by {len(route['holders'])} holders")
+        del self.routes[key]
+        return self._enqueue(key, 'del'), None
+
+    def release(self, holder, prefix, table_id):
+        """Drop a reference on a route, withdrawing it when the last holder leaves"""
+        key = (table_id, prefix)
+        with self.lock:
+            generation, result = self._release_locked(holder, key)
+            if generation is None:
+                return result
+            return self._wait(key, generation)
+
+    def release_all(self, holder):
+        """Release every route held by a connection in one batch"""
+        with self.lock:
+            keys = [key for key, route in self.routes.items() if holder in route['holders']]
+            generation = None
+            for key in keys:
+                generation = self._release_locked(holder, key)[0] or generation
+            if generation is not None:
+                while self.generation < generation:
+                    self.flushed.wait()
+        return len(keys)
+
+    def _apply(self, key, op, route):
+        """Apply one coalesced operation through the route programmer"""
+        table_id, prefix = key
+        self.netlink_ops += 1
+        if op == 'del':
+            return self.route_programmer.delete_route(destination_prefix=prefix, table_id=table_id)
+        return self.route_programmer.program_route(
+            destination_prefix=prefix,
+            srv6_usid=route['srv6_data'].get('srv6_usid'),
+            srv6_data=route['srv6_data'],
+            segs=route['segs'],
+            outbound_interface=route['interface'],
+            table_id=table_id,
+            replace=route['replace']
+        )
+
+    def flush(self):
+        """Apply all pending operations as one batch"""
+        with self.lock:
+            batch, self.pending = self.pending, {}
+            generation = self.next_generation
+            self.next_generation += 1
+
+        results = {}
+        for key, (op, route) in batch.items():
+            try:
+                results[key] = self._apply(key, op, route)
+            except Exception as e:
+                results[key] = (False, f"Route operation failed: {e}")
+            if not results[key][0]:
+                logger.error(results[key][1])
+
+        with self.lock:
+            for key, (op, route) in batch.items():
+                # A failed add is forgotten so the next request retries it
+                if op == 'add' and not results[key][0] and self.routes.get(key) is route:
+                    del self.routes[key]
+            self.results.update(results)
+            self.generation = generation
+            self.flushed.notify_all()
+        if batch:
+            logger.info(f"Applied {len(batch)} route operations ({len(self.routes)} routes held)")
+
+    def _run(self):
+        while not self.stopping.is_set():
+            self.wakeup.wait()
+            self.wakeup.clear()
+            # Let concurrent requests from other jobs join this batch
+            time.sleep(self.batch_interval)
+            self.flush()
+
+    def status(self):
+        """Routes held, their holders and API/netlink counters"""
+        with self.lock:
+            return {
+                'routes': {f"{table_id}:{prefix}": {'segs': route['segs'], 'holders': len(route['holders']),
+                                                   'jobs': sorted(route['jobs'])}
+                           for (table_id, prefix), route in self.routes.items()},
+                'api_calls': self.api_calls,
+                'api_cache_entries': len(self.api_cache),
+                'netlink_ops': self.netlink_ops
+            }
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """One connection from a job process"""
+
+    def handle(self):
+        agent = self.server.agent
+        holder = next(self.server.holder_ids)
+        job = str(holder)
+        try:
+            for line in self.rfile:
+                try:
+                    request = json.loads(line)
+                    op = request.get('op')
+                    if op == 'hello':
+                        job = str(request.get('job', job))
+                        response = {'ok': True}
+                    elif op == 'route_info':
+                        data = agent.get_route_info(request['source'], request['destination'],
+                                                    bool(request.get('refresh')))
+                        response = {'ok': data is not None, 'data': data}
+                    elif op == 'acquire':
+                        ok, message = agent.acquire(holder, job, request['prefix'], request.get('srv6_data') or {},
+                                                    request.get('segs'), request['interface'],
+                                                    int(request.get('table_id', 254)), bool(request.get('refresh')))
+                        response = {'ok': ok, 'message': message}
+                    elif op == 'release':
+                        ok, message = agent.release(holder, request['prefix'], int(request.get('table_id', 254)))
+                        response = {'ok': ok, 'message': message}
+                    elif op == 'status':
+                        response = {'ok': True, 'data': agent.status()}
+                    else:
+                        response = {'ok': False, 'message': f"Unknown op: {op}"}
+                except Exception as e:
+                    response = {'ok': False, 'message': str(e)}
+                self.wfile.write((json.dumps(response) + '\n').encode())
+        finally:
+            released = agent.release_all(holder)
+            if released:
+                logger.info(f"Job {job} disconnected, released {released} routes")
+
+class RouteAgentServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, agent):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _RequestHandler)
+        os.chmod(socket_path, 0o660)
+        self.agent = agent
+        self.holder_ids = itertools.count(1)
+
+class RouteAgentClient(RouteProgrammer):
+    """Job-side route programmer that forwards requests to the node-local agent"""
+
+    def __init__(self, socket_path, job_id=None):
+        """Connect to the agent; routes stay held until this client is closed"""
+        self.socket_path = socket_path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.rfile = self.sock.makefile('rb')
+        self.lock = threading.Lock()
+        self.job_id = job_id or os.environ.get(
+            'JOB_ID',
+            f"{os.environ.get('MASTER_ADDR', 'localhost')}:{os.environ.get('MASTER_PORT', '29500')}"
+        )
+        self._request({'op': 'hello', 'job': self.job_id})
+
+    def _request(self, request):
+        with self.lock:
+            self.sock.sendall((json.dumps(request) + '\n').encode())
+            line = self.rfile.readline()
+        if not line:
+            raise ConnectionError(f"Route agent at {self.socket_path} closed the connection")
+        return json.loads(line)
+
+    def get_route_info(self, source, destination, refresh=False):
+        """Get route information through the agent's API cache"""
+        response = self._request({'op': 'route_info', 'source': source, 'destination': destination,
+                                  'refresh': refresh})
+        return response.get('data')
+
+    def program_route(self, destination_prefix, srv6_usid, **kwargs):
+        """Ask the agent to program (or share) a route"""
+        try:
+            srv6_data = dict(kwargs.get('srv6_data') or {})
+            if srv6_usid and 'srv6_usid' not in srv6_data:
+                srv6_data['srv6_usid'] = srv6_usid
+            response = self._request({
+                'op': 'acquire',
+                'prefix': destination_prefix,
+                'srv6_data': srv6_data,
+                'segs': kwargs.get('segs'),
+                'interface': kwargs.get('outbound_interface'),
+                'table_id': kwargs.get('table_id', 254),
+                'refresh': bool(kwargs.get('refresh'))
+            })
+            return response['ok'], response.get('message', '')
+        except Exception as e:
+            return False, f"Failed to program route through agent: {str(e)}"
+
+    def delete_route(self, destination_prefix, **kwargs):
+        """Release this job's reference on a route"""
+        try:
+            response = self._request({'op': 'release', 'prefix': destination_prefix,
+                                      'table_id': kwargs.get('table_id', 254)})
+            return response['ok'], response.get('message', '')
+        except Exception as e:
+            return False, f"Failed to delete route through agent: {str(e)}"
+
+    def status(self):
+        return self._request({'op': 'status'}).get('data')
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+    def __del__(self):
+        if hasattr(self, 'sock'):
+            self.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Node-local SRv6 route agent")
+    parser.add_argument('--socket', default=os.environ.get('ROUTE_AGENT_SOCKET', DEFAULT_SOCKET))
+    parser.add_argument('--api', default=os.environ.get('JALAPENO_API_ENDPOINT'), help="Network API endpoint")
+    parser.add_argument('--platform', default=os.environ.get('ROUTE_PLATFORM', 'linux'))
+    args = parser.parse_args(argv)
+
+    if not args.api:
+        parser.error("--api or $JALAPENO_API_ENDPOINT is required")
+
+    agent = RouteAgent(args.api, platform=args.platform)
+    server = RouteAgentServer(args.socket, agent)
+    logger.info(f"Route agent listening on {args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        agent.stop()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""Compile a job's complete route plan into a compact, memory-mapped artifact
+
+The artifact holds, for every rank, the routes (prefix and final segment
+list) to every other rank. Each rank maps the file and reads only its own
+slice, so startup needs no API calls.
+
+Layout (little-endian):
+    header   magic, format version, rank/route/SID/string counts,
+             creation time, topology version, section offsets
+    index    one entry per rank, sorted by rank:
+             rank, hostname string id, first route, route count
+    routes   fixed-size records: prefix (16 bytes), prefix length,
+             IP version, segment count, peer hostname string id, first SID
+    sids     interned 16-byte SIDs; identical segment lists share a run
+    strings  offset table followed by UTF-8 hostnames
+"""
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import hashlib
+import logging
+import argparse
+import ipaddress
+
+from segment_list import build_segment_list
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PLAN_MAGIC = b'SRV6PLAN'
+PLAN_FORMAT_VERSION = 1
+
+# magic, format version, reserved, ranks, routes, sids, strings, created,
+# topology version, index/routes/sids/strings offsets
+HEADER = struct.Struct('<8sHHIIIIQ64sQQQQ')
+INDEX_ENTRY = struct.Struct('<IIII')
+ROUTE_RECORD = struct.Struct('<16sBBBxII')
+SID_LEN = 16
+STRING_OFFSET = struct.Struct('<I')
+
+class StalePlanError(Exception):
+    """Raised when a route plan does not match the running job or topology"""
+
+def _topology_hash(paths):
+    """Derive a topology version from the API responses a plan was built from"""
+    digest = hashlib.sha256(json.dumps(paths, sort_keys=True).encode()).hexdigest()
+    return digest[:16]
+
+def collect_paths(programmer, nodes):
+    """Query the API for every ordered pair of nodes"""
+    paths = {}
+    for src in nodes:
+        source = f"hosts/{src['hostname']}"
+        for dst in nodes:
+            if dst['hostname'] == src['hostname']:
+                continue
+            destination = f"hosts/{dst['hostname']}"
+            paths.setdefault(source, {})[destination] = programmer.get_route_info(source, destination)
+    return paths
+
+def compile_plan(nodes, paths, resolve, topology_version=None):
+    """Compile a route plan into bytes
+
+    nodes is the list of {'rank', 'hostname'} for the job, paths maps
+    source -> destination -> API response and resolve turns an API response
+    into (prefix, srv6_data) or None.
+    """
+    nodes = sorted(nodes, key=lambda node: node['rank'])
+    topology_version = topology_version or _topology_hash(paths)
+
+    strings, string_ids = [], {}
+    def intern_string(value):
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value)
+        return string_ids[value]
+
+    sids, sid_runs = [], {}
+    def intern_segs(segs):
+        key = tuple(segs)
+        if key not in sid_runs:
+            sid_runs[key] = len(sids)
+            sids.extend(ipaddress.IPv6Address(seg).packed for seg in segs)
+        return sid_runs[key]
+
+    index, routes = [], []
+    for src in nodes:
+        source = f"hosts/{src['hostname']}"
+        first_route = len(routes)
+        for dst in nodes:
+            if dst['hostname'] == src['hostname']:
+                continue
+            destination = f"hosts/{dst['hostname']}"
+            api_response = paths.get(source, {}).get(destination)
+            resolved = resolve(source, destination, api_response) if api_response else None
+            if not resolved:
+                logger.warning(f"No route planned for {source} -> {destination}")
+                continue
+            prefix, srv6_data = resolved
+            net = ipaddress.ip_network(prefix, strict=False)
+            segs = build_segment_list(srv6_data.get('srv6_usid'), srv6_data)
+            routes.append(ROUTE_RECORD.pack(
+                net.network_address.packed.ljust(16, b'\0'), net.prefixlen, net.version,
+                len(segs), intern_string(dst['hostname']), intern_segs(segs)
+            ))
+        index.append(INDEX_ENTRY.pack(src['rank'], intern_string(src['hostname']),
+                                      first_route, len(routes) - first_route))
+
+    encoded = [value.encode() for value in strings]
+    string_offsets, position = [], 0
+    for value in encoded:
+        string_offsets.append(STRING_OFFSET.pack(position))
+        position += len(value)
+    # Sentinel so the length of the last string is known
+    string_offsets.append(STRING_OFFSET.pack(position))
+
+    index_offset = HEADER.size
+    routes_offset = index_offset + INDEX_ENTRY.size * len(index)
+    sids_offset = routes_offset + ROUTE_RECORD.size * len(routes)
+    strings_offset = sids_offset + SID_LEN * len(sids)
+
+    header = HEADER.pack(
+        PLAN_MAGIC, PLAN_FORMAT_VERSION, 0, len(index), len(routes), len(sids), len(strings),
+        int(time.time()), topology_version.encode()[:64], index_offset, routes_offset,
+        sids_offset, strings_offset
+    )
+    return b''.join([header] + index + routes + sids + string_offsets + encoded)
+
+class RoutePlan:
+    """Read-only, memory-mapped view of a compiled route plan"""
+
+    def __init__(self, path):
+        """Map the plan file and validate its header"""
+        self.path = path
+        with open(path, 'rb') as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._read_header()
+        except (ValueError, struct.error) as e:
+            self.buf.close()
+            raise ValueError(f"Corrupt route plan {path}: {e}")
+
+    def _read_header(self):
+        """Unpack the header and check every section lies within the file"""
+        if len(self.buf) < HEADER.size:
+            raise ValueError(f"{len(self.buf)} bytes is shorter than the header")
+        (magic, format_version, _, self.num_ranks, self.num_routes, self.num_sids,
+         self.num_strings, self.created, topology_version, self.index_offset,
+         self.routes_offset, self.sids_offset, self.strings_offset) = HEADER.unpack_from(self.buf, 0)
+
+        if magic != PLAN_MAGIC:
+            raise ValueError("not a route plan")
+        if format_version != PLAN_FORMAT_VERSION:
+            raise ValueError(f"Unsupported route plan format version {format_version}")
+        self.topology_version = topology_version.rstrip(b'\0').decode()
+
+        sections = (
+            ('index', self.index_offset, INDEX_ENTRY.size * self.num_ranks),
+            ('routes', self.routes_offset, ROUTE_RECORD.size * self.num_routes),
+            ('sids', self.sids_offset, SID_LEN * self.num_sids),
+            ('strings', self.strings_offset, STRING_OFFSET.size * (self.num_strings + 1)),
+        )
+        for name, offset, size in sections:
+            if offset < HEADER.size or offset + size > len(self.buf):
+                raise ValueError(f"{name} section ({size} bytes at {offset}) is outside the file")
+        # The sentinel offset is the size of the string data
+        strings_end = STRING_OFFSET.unpack_from(
+            self.buf, self.strings_offset + STRING_OFFSET.size * self.num_strings)[0]
+        if self.strings_offset + STRING_OFFSET.size * (self.num_strings + 1) + strings_end > len(self.buf):
+            raise ValueError("string data is outside the file")
+
+    def _string(self, string_id):
+        """Read one hostname from the string table"""
+        if string_id >= self.num_strings:
+            raise ValueError(f"String id {string_id} out of range in route plan {self.path}")
+        table = self.strings_offset
+        start, end = struct.unpack_from('<II', self.buf, table + STRING_OFFSET.size * string_id)
+        data = table + STRING_OFFSET.size * (self.num_strings + 1)
+        return self.buf[data + start:data + end].decode()
+
+    def _index_entry(self, rank):
+        """Find the index entry of a rank (binary search, the index is sorted by rank)"""
+        lo, hi = 0, self.num_ranks
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry = INDEX_ENTRY.unpack_from(self.buf, self.index_offset + INDEX_ENTRY.size * mid)
+            if entry[0] == rank:
+                return entry
+            if entry[0] < rank:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def hostname(self, rank):
+        """Hostname the plan was compiled for at this rank"""
+        entry = self._index_entry(rank)
+        return self._string(entry[1]) if entry else None
+
+    def routes_for_rank(self, rank):
+        """Return this rank's routes as a list of {'hostname', 'prefix', 'segs'}"""
+        entry = self._index_entry(rank)
+        if not entry:
+            raise StalePlanError(f"Rank {rank} is not in route plan {self.path}")
+
+        _, _, first_route, count = entry
+        if first_route + count > self.num_routes:
+            raise ValueError(f"Routes of rank {rank} are out of range in route plan {self.path}")
+        routes = []
+        for i in range(first_route, first_route + count):
+            packed, prefix_len, version, nsegs, hostname_id, first_sid = ROUTE_RECORD.unpack_from(
+                self.buf, self.routes_offset + ROUTE_RECORD.size * i)
+            if first_sid + nsegs > self.num_sids:
+                raise ValueError(f"SIDs of a route of rank {rank} are out of range in route plan {self.path}")
+            address = ipaddress.ip_address(packed[:4] if version == 4 else packed)
+            sid_start = self.sids_offset + SID_LEN * first_sid
+            segs = [str(ipaddress.IPv6Address(self.buf[sid_start + SID_LEN * j:sid_start + SID_LEN * (j + 1)]))
+                    for j in range(nsegs)]
+            routes.append({
+                'hostname': self._string(hostname_id),
+                'prefix': f"{address}/{prefix_len}",
+                'segs': segs
+            })
+        return routes
+
+    def validate(self, nodes, topology_version=None, max_age=None):
+        """Raise StalePlanError unless the plan matches the job membership and topology version"""
+        if topology_version and topology_version != self.topology_version:
+            raise StalePlanError(f"Route plan topology version {self.topology_version} "
+                                 f"does not match {topology_version}")
+        if max_age and time.time() - self.created > max_age:
+            raise StalePlanError(f"Route plan is older than {max_age} seconds")
+        if len(nodes) != self.num_ranks:
+            raise StalePlanError(f"Route plan has {self.num_ranks} ranks, job has {len(nodes)}")
+        for node in nodes:
+            if self.hostname(node['rank']) != node['hostname']:
+                raise StalePlanError(f"Rank {node['rank']} is {node['hostname']} but the route plan "
+                                     f"has {self.hostname(node['rank'])}")
+
+    def close(self):
+        self.buf.close()
+
+def load_nodes(path):
+    """Load the job membership: a JSON list of {'rank', 'hostname'} or a comma-separated host list"""
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return [{'rank': i, 'hostname': h.strip()} for i, h in enumerate(path.split(',')) if h.strip()]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile and inspect SRv6 route plans")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    compile_parser = subparsers.add_parser('compile', help="Compile a route plan for a job")
+    compile_parser.add_argument('--nodes', default=os.environ.get('HOSTS'),
+                                help="JSON file of {rank, hostname} or comma-separated hostnames (default: $HOSTS)")
+    source = compile_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--api', help="Network API endpoint to query")
+    source.add_argument('--snapshot', help="Topology snapshot: JSON {version, paths: {src: {dst: response}}}")
+    compile_parser.add_argument('--master-addr', default=os.environ.get('MASTER_ADDR'),
+                                help="Job master address; an IPv6 address selects IPv6 prefixes (default: $MASTER_ADDR)")
+    compile_parser.add_argument('--topology-version', help="Topology version to stamp (default: hash of the paths)")
+    compile_parser.add_argument('--save-snapshot', help="Also write the API responses as a snapshot")
+    compile_parser.add_argument('--output', '-o', required=True, help="Route plan file to write")
+
+    show_parser = subparsers.add_parser('show', help="Print a route plan")
+    show_parser.add_argument('plan')
+    show_parser.add_argument('--rank', type=int, help="Only print this rank's routes")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'show':
+        plan = RoutePlan(args.plan)
+        print(f"topology version {plan.topology_version}, {plan.num_ranks} ranks, "
+              f"{plan.num_routes} routes, {plan.num_sids} SIDs")
+        ranks = [args.rank] if args.rank is not None else range(plan.num_ranks)
+        for rank in ranks:
+            print(f"rank {rank} ({plan.hostname(rank)})")
+            for route in plan.routes_for_rank(rank):
+                print(f"  {route['prefix']} -> {route['hostname']} via {','.join(route['segs'])}")
+        plan.close()
+        return 0
+
+    if not args.nodes:
+        parser.error("--nodes or $HOSTS is required")
+    nodes = load_nodes(args.nodes)
+    if args.master_addr:
+        # Prefix selection follows the job's address family, as at runtime
+        os.environ['MASTER_ADDR'] = args.master_addr
+
+    from controller import NetworkProgrammer
+    programmer = NetworkProgrammer(args.api or '', program_routes=False)
+
+    topology_version = args.topology_version
+    if args.snapshot:
+        with open(args.snapshot) as f:
+            snapshot = json.load(f)
+        paths = snapshot['paths']
+        topology_version = topology_version or snapshot.get('version')
+    else:
+        paths = collect_paths(programmer, nodes)
+
+    topology_version = topology_version or _topology_hash(paths)
+    if args.save_snapshot:
+        with open(args.save_snapshot, 'w') as f:
+            json.dump({'version': topology_version, 'paths': paths}, f)
+
+    data = compile_plan(nodes, paths, programmer.resolve_peer, topology_version)
+    tmp_path = f"{args.output}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, args.output)
+    logger.info(f"Wrote route plan {args.output} ({len(data)} bytes, topology version {topology_version})")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
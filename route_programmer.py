@@ -2,7 +2,26 @@ from pyroute2 import IPRoute
 import vpp_papi
 from abc import ABC, abstractmethod
 import os
+import logging
 import ipaddress
+from segment_list import (build_segment_list, get_encap_mode, kernel_supports_encap_red,
+                          encap_overhead, route_advmss, IPV6_MIN_MTU, INNER_TCP_HEADER_LEN)
+
+logger = logging.getLogger(__name__)
+
+# Kernel value for seg6 mode encap.red (SEG6_IPTUN_MODE_ENCAP_RED)
+SEG6_IPTUN_MODE_ENCAP_RED = 3
+
+def _register_encap_red():
+    """Teach pyroute2 the encap.red seg6 mode; it silently falls back to encap otherwise"""
+    try:
+        from pyroute2.netlink.rtnl.rtmsg import rtmsg_base
+        sr_hdr = rtmsg_base.seg6_encap_info.ipv6_sr_hdr
+        sr_hdr.encapmodes.setdefault('encap.red', SEG6_IPTUN_MODE_ENCAP_RED)
+        sr_hdr.r_encapmodes.setdefault(SEG6_IPTUN_MODE_ENCAP_RED, 'encap.red')
+        return True
+    except (ImportError, AttributeError):
+        return False
 
 class RouteProgrammer(ABC):
     @abstractmethod
@@ -13,51 +32,82 @@ class RouteProgrammer(ABC):
     def delete_route(self, destination_prefix, **kwargs):
         pass
 
+    def program_route_set(self, route_set, failed=None, **kwargs):
+        """Program every valid route of a RouteSet, one program_route call each
+
+        failed, if given, is a list that receives the peers of the routes
+        that were invalid or could not be programmed.
+        """
+        # Each route carries its own table
+        kwargs.pop('table_id', None)
+        valid_routes = route_set.valid()
+        failures = len(route_set) - len(valid_routes)
+        if failed is not None:
+            failed.extend(route[4] for route in route_set.invalid())
+        for prefix, _, segs, table_id, peer in valid_routes:
+            success, message = self.program_route(prefix, None, segs=segs, table_id=table_id, **kwargs)
+            if not success:
+                failures += 1
+                if failed is not None:
+                    failed.append(peer)
+        return failures == 0, f"Programmed {len(route_set) - failures} of {len(route_set)} routes"
+
+    def delete_route_set(self, route_set, **kwargs):
+        """Delete every route of a RouteSet"""
+        kwargs.pop('table_id', None)
+        failures = 0
+        for prefix, _, _, table_id, _ in route_set:
+            success, message = self.delete_route(prefix, table_id=table_id, **kwargs)
+            if not success:
+                failures += 1
+        return failures == 0, f"Deleted {len(route_set) - failures} of {len(route_set)} routes"
+
 class LinuxRouteProgrammer(RouteProgrammer):
     def __init__(self):
         if os.geteuid() != 0:
             raise PermissionError("Root privileges required for route programming. Please run with sudo.")
         self.iproute = IPRoute()
+        self.supports_encap_red = kernel_supports_encap_red() and _register_encap_red()
+        self.link_mtus = {}
 
-    def _expand_srv6_usid(self, usid):
-        """Expand SRv6 USID to full IPv6 address"""
-        # Remove any trailing colons
-        usid = usid.rstrip(':')
-        
-        # Split the USID into parts
-        parts = usid.split(':')
-        
-        # Keep only non-empty parts
-        parts = [p for p in parts if p]
-        
-        # Join with :: to represent remaining zeros
-        return ':'.join(parts) + '::'
-
-    def _append_dest_function(self, usid, srv6_data=None):
-        """Append destination function to SRv6 USID"""
-        # First try to get function from API response
-        function = None
-        if srv6_data and 'srv6_endpoint_behavior' in srv6_data:
-            try:
-                # Convert to hex string if it's a number
-                function = hex(int(srv6_data['srv6_endpoint_behavior']))[2:]
-            except (ValueError, TypeError):
-                pass
-        
-        # Fall back to environment variable if no function in API data
-        if not function:
-            function = os.getenv('DEST_FUNCTION')
-            if not function:
-                return usid
-        
-        # Split USID into parts and keep only non-empty parts
-        parts = [p for p in usid.split(':') if p]
-        
-        # Add function as a new part
-        parts.append(function)
-        
-        # Join with :: to represent remaining zeros
-        return ':'.join(parts) + '::'
+    def _get_link_mtu(self, if_index):
+        """Get (and cache) the MTU of an interface"""
+        if if_index not in self.link_mtus:
+            self.link_mtus[if_index] = self.iproute.get_links(if_index)[0].get_attr('IFLA_MTU')
+        return self.link_mtus[if_index]
+
+    def _route_metrics(self, if_index, segs, mode, net):
+        """Route MTU and advmss accounting for the SRv6 encapsulation overhead"""
+        if os.environ.get('SRV6_MTU_ACCOUNTING', '1') == '0':
+            return None
+
+        path_mtu = self._get_link_mtu(if_index)
+        if os.environ.get('SRV6_PATH_MTU'):
+            path_mtu = min(path_mtu, int(os.environ['SRV6_PATH_MTU']))
+
+        overhead = encap_overhead(segs, mode)
+        advmss = route_advmss(path_mtu, segs, mode, net.version)
+        inner = path_mtu - overhead
+        if net.version == 6 and inner < IPV6_MIN_MTU:
+            logger.warning(f"Path MTU {path_mtu} leaves {inner} bytes after {overhead} bytes of SRv6 "
+                           f"encapsulation to {net}, below the IPv6 minimum of {IPV6_MIN_MTU}")
+
+        # The headers cost the same on every segment, so a larger MTU cannot make
+        # up for them; report the payload lost per segment instead
+        message_size = int(os.environ.get('SRV6_MESSAGE_SIZE', '0'))
+        plain_mss = path_mtu - INNER_TCP_HEADER_LEN[net.version]
+        if message_size > 0 and advmss > 0:
+            segments = -(-message_size // advmss)
+            plain_segments = -(-message_size // plain_mss)
+            if segments > plain_segments:
+                logger.warning(f"Messages of {message_size} bytes to {net} take {segments} segments instead "
+                               f"of {plain_segments}: {overhead} bytes of SRv6 headers per segment leave "
+                               f"{advmss} of {path_mtu} bytes for payload ({advmss / path_mtu:.1%} "
+                               f"vs {plain_mss / path_mtu:.1%} without encapsulation)")
+
+        # The kernel subtracts the seg6 encap headroom from the route MTU itself,
+        # so the MTU metric is the outer path MTU while advmss is the inner payload
+        return {'mtu': path_mtu, 'advmss': advmss}
 
     def program_route(self, destination_prefix, srv6_usid, **kwargs):
         """Program Linux SRv6 route using pyroute2"""
@@ -81,41 +131,47 @@ class LinuxRouteProgrammer(RouteProgrammer):
             # Get SRv6 data from kwargs if available
             srv6_data = kwargs.get('srv6_data', {})
 
-            # Validate and normalize the SRv6 USID
+            # Build the compressed segment list (destination function appended)
             try:
-                expanded_usid = self._expand_srv6_usid(srv6_usid)
-                # Append destination function if specified
-                expanded_usid = self._append_dest_function(expanded_usid, srv6_data)
-                ipaddress.IPv6Address(expanded_usid)
+                segs = kwargs.get('segs') or build_segment_list(srv6_usid, srv6_data)
+                for seg in segs:
+                    ipaddress.IPv6Address(seg)
             except ValueError as e:
                 raise ValueError(f"Invalid SRv6 USID: {e}")
             
+            mode = get_encap_mode(self.supports_encap_red)
+            
             # Get interface index
             if_index = self.iproute.link_lookup(ifname=kwargs.get('outbound_interface'))[0]
             
-            # Create encap info
+            # Create encap info; pyroute2 writes segs in SRH order, which is
+            # the reverse of the order they are visited in
             encap = {'type': 'seg6',
-                    'mode': 'encap',
-                    'segs': [expanded_usid]}
+                    'mode': mode,
+                    'segs': segs[::-1]}
             
-            # Try to delete existing route first
-            try:
-                self.iproute.route('del', table=table_id, dst=str(net))
-                print(f"\nDeleted existing route to {str(net)} in table {table_id}")
-            except Exception as e:
-                # Ignore errors if route doesn't exist
-                pass
+            # Try to delete existing route first, unless it is replaced in place
+            # (a live route keeps forwarding until the new path is installed)
+            replace = kwargs.get('replace', False)
+            if not replace:
+                try:
+                    self.iproute.route('del', table=table_id, dst=str(net))
+                    logger.debug(f"Deleted existing route to {str(net)} in table {table_id}")
+                except Exception as e:
+                    # Ignore errors if route doesn't exist
+                    pass
             
-            print(f"Adding route to {str(net)} with encap: {encap} to table {table_id}")
+            metrics = self._route_metrics(if_index, segs, mode, net)
+            
+            logger.debug(f"Adding route to {str(net)} with encap: {encap} metrics: {metrics} to table {table_id}")
             
             # Add new route
-            self.iproute.route('add',
-                             table=table_id,
-                             dst=str(net),
-                             oif=if_index,
-                             encap=encap)
+            route_args = {'table': table_id, 'dst': str(net), 'oif': if_index, 'encap': encap}
+            if metrics:
+                route_args['metrics'] = metrics
+            self.iproute.route('replace' if replace else 'add', **route_args)
             
-            return True, f"Route to {destination_prefix} via {expanded_usid} programmed successfully in table {table_id}"
+            return True, f"Route to {destination_prefix} via {','.join(segs)} programmed successfully in table {table_id}"
         except Exception as e:
             return False, f"Failed to program route: {str(e)}"
         
@@ -150,6 +206,64 @@ class LinuxRouteProgrammer(RouteProgrammer):
         if hasattr(self, 'iproute'):
             self.iproute.close()
 
+    def program_route_set(self, route_set, failed=None, **kwargs):
+        """Program a RouteSet in one pass
+
+        Validation is vectorized over the set, the interface and encap mode are
+        looked up once, metrics are computed once per segment count and IP
+        version, and each route is a single netlink replace with no per-route
+        parsing or logging. failed, if given, receives the peers of the
+        routes that were not programmed.
+        """
+        if failed is not None:
+            failed.extend(route[4] for route in route_set.invalid())
+        try:
+            if not kwargs.get('outbound_interface'):
+                raise ValueError("outbound_interface is required")
+            if_index = self.iproute.link_lookup(ifname=kwargs.get('outbound_interface'))[0]
+            mode = get_encap_mode(self.supports_encap_red)
+        except Exception as e:
+            if failed is not None:
+                failed.extend(route[4] for route in route_set.valid())
+            return False, f"Failed to program routes: {str(e)}"
+
+        valid_routes = route_set.valid()
+        failures = len(route_set) - len(valid_routes)
+        metrics_cache = {}
+        for prefix, prefix_len, segs, table_id, peer in valid_routes:
+            try:
+                version = 6 if ':' in prefix else 4
+                metrics_key = (len(segs), version)
+                if metrics_key not in metrics_cache:
+                    metrics_cache[metrics_key] = self._route_metrics(if_index, segs, mode,
+                                                                     ipaddress.ip_network(prefix))
+                route_args = {'table': table_id, 'dst': prefix, 'oif': if_index,
+                              'encap': {'type': 'seg6', 'mode': mode, 'segs': segs[::-1]}}
+                if metrics_cache[metrics_key]:
+                    route_args['metrics'] = metrics_cache[metrics_key]
+                self.iproute.route('replace', **route_args)
+            except Exception as e:
+                failures += 1
+                if failed is not None:
+                    failed.append(peer)
+                logger.error(f"Failed to program route to {prefix}: {e}")
+
+        message = f"Programmed {len(route_set) - failures} of {len(route_set)} routes ({mode})"
+        logger.info(message)
+        return failures == 0, message
+
+    def delete_route_set(self, route_set, **kwargs):
+        """Delete a RouteSet in one pass"""
+        failures = 0
+        for prefix, _, _, table_id, _ in route_set:
+            try:
+                self.iproute.route('del', table=table_id, dst=prefix)
+            except Exception as e:
+                if "No such process" not in str(e):
+                    failures += 1
+                    logger.error(f"Failed to delete route to {prefix}: {e}")
+        return failures == 0, f"Deleted {len(route_set) - failures} of {len(route_set)} routes"
+
     def program_l3vpn_route(self, destination_prefix, srv6_usid, vpn_label, **kwargs):
         """Program Linux SRv6 L3VPN route"""
         try:
@@ -192,14 +306,15 @@ class LinuxRouteProgrammer(RouteProgrammer):
                 # Ignore errors if route doesn't exist
                 pass
             
-            print(f"Adding L3VPN route with encap: {encap} to table {table_id}")
+            metrics = self._route_metrics(if_index, [srv6_usid], 'encap', net)
+            
+            print(f"Adding L3VPN route with encap: {encap} metrics: {metrics} to table {table_id}")
             
             # Add new route
-            self.iproute.route('add',
-                             table=table_id,
-                             dst=str(net),
-                             oif=if_index,
-                             encap=encap)
+            route_args = {'table': table_id, 'dst': str(net), 'oif': if_index, 'encap': encap}
+            if metrics:
+                route_args['metrics'] = metrics
+            self.iproute.route('add', **route_args)
             
             return True, f"L3VPN route to {destination_prefix} via {srv6_usid} programmed successfully in table {table_id}"
         except Exception as e:
@@ -225,20 +340,6 @@ class VPPRouteProgrammer(RouteProgrammer):
         except Exception as e:
             raise RuntimeError(f"Failed to connect to VPP: {str(e)}")
 
-    def _expand_srv6_usid(self, usid):
-        """Expand SRv6 USID to full IPv6 address"""
-        # Remove any trailing colons
-        usid = usid.rstrip(':')
-        
-        # Split the USID into parts
-        parts = usid.split(':')
-        
-        # Keep only non-empty parts
-        parts = [p for p in parts if p]
-        
-        # Join with :: to represent remaining zeros
-        return ':'.join(parts) + '::'
-
     def program_route(self, destination_prefix, srv6_usid, **kwargs):
         """Program VPP SRv6 route using CLI"""
         try:
@@ -249,12 +350,19 @@ class VPPRouteProgrammer(RouteProgrammer):
             # Validate inputs
             try:
                 net = ipaddress.ip_network(destination_prefix)
-                expanded_usid = self._expand_srv6_usid(srv6_usid)
+                segs = kwargs.get('segs') or build_segment_list(srv6_usid, kwargs.get('srv6_data'))
+                for seg in segs:
+                    ipaddress.IPv6Address(seg)
             except ValueError as e:
                 raise ValueError(f"Invalid input parameters: {str(e)}")
 
-            # Add SR policy
-            policy_cmd = f"sr policy add bsid {bsid} next {expanded_usid} encap"
+            # The vppctl sr policy CLI only exposes full encapsulation
+            if get_encap_mode() == 'encap.red' and 'VPP_DEBUG' in os.environ:
+                print("encap.red not available through vppctl, using encap")
+
+            # Add SR policy, one next per segment in visiting order
+            next_hops = ' '.join(f"next {seg}" for seg in segs)
+            policy_cmd = f"sr policy add bsid {bsid} {next_hops} encap"
             if 'VPP_DEBUG' in os.environ:
                 print(f"Executing: vppctl {policy_cmd}")
             result = self.subprocess.run(['vppctl'] + policy_cmd.split(), 
@@ -0,0 +1,224 @@
+import socket
+import numpy as np
+
+from segment_list import build_segment_list
+
+ROUTE_DTYPE = np.dtype([
+    ('table_id', '<u4'),
+    ('version', 'u1'),
+    ('prefix_len', 'u1'),
+    ('prefix_hi', '<u8'),
+    ('prefix_lo', '<u8'),
+    ('sid_list', '<i4'),
+    ('peer', '<i4'),
+])
+
+# Fields identifying a route; sid_list and peer are its value
+KEY_FIELDS = ('table_id', 'version', 'prefix_len', 'prefix_hi', 'prefix_lo')
+
+_MASK64 = (1 << 64) - 1
+_ALL_ONES = np.uint64(_MASK64)
+
+class InternTable:
+    """Interned values (SID lists, peer names) referenced by index"""
+
+    def __init__(self):
+        self.values = []
+        self.ids = {}
+
+    def intern(self, value):
+        if value not in self.ids:
+            self.ids[value] = len(self.values)
+            self.values.append(value)
+        return self.ids[value]
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __len__(self):
+        return len(self.values)
+
+def _parse_prefix(prefix):
+    """Parse 'addr/len' into (version, prefix_len, hi, lo) without building ipaddress objects"""
+    address, _, length = prefix.partition('/')
+    try:
+        if ':' in address:
+            value = int.from_bytes(socket.inet_pton(socket.AF_INET6, address), 'big')
+            version, prefix_len, hi, lo = 6, int(length) if length else 128, value >> 64, value & _MASK64
+        else:
+            value = int.from_bytes(socket.inet_pton(socket.AF_INET, address), 'big')
+            version, prefix_len, hi, lo = 4, int(length) if length else 32, 0, value
+    except OSError:
+        raise ValueError(f"Invalid destination prefix: {prefix}")
+    # Lengths beyond the address size are flagged by validate(); the column only holds a byte
+    if not 0 <= prefix_len <= 255:
+        raise ValueError(f"Invalid destination prefix length: {prefix}")
+    return version, prefix_len, hi, lo
+
+def _valid_segs(segs):
+    """A SID list is valid if it is non-empty and every SID is an IPv6 address"""
+    try:
+        for seg in segs:
+            socket.inet_pton(socket.AF_INET6, seg)
+    except (OSError, TypeError):
+        return False
+    return len(segs) > 0
+
+def _format_prefix(version, prefix_len, hi, lo):
+    if version == 6:
+        return f"{socket.inet_ntop(socket.AF_INET6, ((hi << 64) | lo).to_bytes(16, 'big'))}/{prefix_len}"
+    return f"{socket.inet_ntop(socket.AF_INET, lo.to_bytes(4, 'big'))}/{prefix_len}"
+
+class RouteSet:
+    """Compact, array-backed set of SRv6 routes
+
+    Prefixes are stored as packed 128-bit integers (two uint64 columns) and
+    SID lists and peer names are interned, so validation, dedup and diff run
+    as numpy operations over the whole set instead of per route.
+    """
+
+    def __init__(self, routes=None, sid_lists=None, peers=None):
+        self.routes = routes if routes is not None else np.zeros(0, dtype=ROUTE_DTYPE)
+        self.sid_lists = sid_lists or InternTable()
+        self.peers = peers or InternTable()
+
+    def __len__(self):
+        return len(self.routes)
+
+    def _subset(self, index):
+        return RouteSet(self.routes[index], self.sid_lists, self.peers)
+
+    @classmethod
+    def from_routes(cls, routes, sid_lists=None, peers=None):
+        """Build from an iterable of (prefix, segs, table_id, peer)"""
+        route_set = cls(sid_lists=sid_lists, peers=peers)
+        rows = []
+        for prefix, segs, table_id, peer in routes:
+            version, prefix_len, hi, lo = _parse_prefix(prefix)
+            rows.append((table_id, version, prefix_len, hi, lo,
+                         route_set.sid_lists.intern(tuple(segs)),
+                         route_set.peers.intern(peer) if peer is not None else -1))
+        route_set.routes = np.array(rows, dtype=ROUTE_DTYPE)
+        return route_set
+
+    @classmethod
+    def from_api_responses(cls, responses, table_id=254, sid_lists=None, peers=None):
+        """Build from API responses keyed by peer hostname
+
+        Segment lists are built once per distinct (srv6_usid, SID list,
+        behavior) rather than once per route.
+        """
+        segs_cache = {}
+        routes = []
+        for peer, response in responses.items():
+            dest_info = response.get('destination_info') or {}
+            srv6_data = response.get('srv6_data') or {}
+            if 'prefix' not in dest_info or 'prefix_len' not in dest_info or not srv6_data:
+                continue
+            sid_list = srv6_data.get('srv6_sid_list')
+            cache_key = (srv6_data.get('srv6_usid'), tuple(sid_list) if isinstance(sid_list, list) else sid_list,
+                         srv6_data.get('srv6_endpoint_behavior'))
+            segs = segs_cache.get(cache_key)
+            if segs is None:
+                segs = segs_cache[cache_key] = build_segment_list(srv6_data.get('srv6_usid'), srv6_data)
+            routes.append((f"{dest_info['prefix']}/{dest_info['prefix_len']}", segs, table_id, peer))
+        return cls.from_routes(routes, sid_lists, peers)
+
+    def validate(self):
+        """Return a boolean mask of routes with a valid prefix, no host bits set and a valid SID list"""
+        r = self.routes
+        is_v6 = r['version'] == 6
+        max_len = np.where(is_v6, 128, 32)
+        valid = (r['prefix_len'] <= max_len) & ((r['version'] == 6) | (r['version'] == 4))
+
+        # Number of host bits in each 64-bit half; IPv4 lives in the low half
+        plen = r['prefix_len'].astype(np.int64)
+        lo_host = np.where(is_v6, np.clip(128 - plen, 0, 64), np.clip(32 - plen, 0, 32))
+        hi_host = np.where(is_v6, np.clip(64 - plen, 0, 64), 64)
+
+        def host_mask(bits):
+            # (1 << bits) - 1 without shifting by 64
+            shifted = np.left_shift(np.uint64(1), np.minimum(bits, 63).astype(np.uint64)) - np.uint64(1)
+            return np.where(bits >= 64, _ALL_ONES, shifted)
+
+        valid &= (r['prefix_lo'] & host_mask(lo_host)) == 0
+        valid &= np.where(is_v6, (r['prefix_hi'] & host_mask(hi_host)) == 0, r['prefix_hi'] == 0)
+        # SID lists are checked once per distinct list, not once per route
+        sid_ok = np.fromiter((_valid_segs(segs) for segs in self.sid_lists.values), dtype=bool,
+                             count=len(self.sid_lists))
+        if len(sid_ok):
+            valid &= (r['sid_list'] >= 0) & sid_ok[np.clip(r['sid_list'], 0, None)]
+        else:
+            valid &= False
+        return valid
+
+    def valid(self):
+        """Only the routes that pass validate()"""
+        return self._subset(self.validate())
+
+    def invalid(self):
+        """Only the routes that fail validate()"""
+        return self._subset(~self.validate())
+
+    def _key_order(self, extra=()):
+        """Indices sorting routes by key (then by the extra sort keys, last has lowest priority)"""
+        r = self.routes
+        return np.lexsort(tuple(extra) + tuple(r[field] for field in reversed(KEY_FIELDS)))
+
+    def _same_key(self, routes, order):
+        """Boolean array: routes[order[i]] has the same key as routes[order[i + 1]]"""
+        a, b = routes[order[:-1]], routes[order[1:]]
+        same = np.ones(len(order) - 1, dtype=bool)
+        for field in KEY_FIELDS:
+            same &= a[field] == b[field]
+        return same
+
+    def dedup(self):
+        """Keep one route per (table, prefix); later entries win"""
+        if len(self.routes) < 2:
+            return self._subset(slice(None))
+        position = np.arange(len(self.routes))
+        order = self._key_order(extra=(position,))
+        last_of_group = np.append(~self._same_key(self.routes, order), True)
+        return self._subset(np.sort(order[last_of_group]))
+
+    def _remap_sid_lists(self, other):
+        """other's sid_list ids expressed in this set's intern table"""
+        if other.sid_lists is self.sid_lists:
+            return other.routes['sid_list']
+        mapping = np.array([self.sid_lists.intern(segs) for segs in other.sid_lists.values] or [0],
+                           dtype=np.int32)
+        return mapping[other.routes['sid_list']]
+
+    def diff(self, new):
+        """Compare with a newer route set (both deduplicated)
+
+        Returns (added, removed, changed) route sets: routes only in new,
+        routes only in self, and routes in both whose SID list differs
+        (taken from new).
+        """
+        new_sids = self._remap_sid_lists(new)
+        combined = np.concatenate([self.routes, new.routes])
+        sids = np.concatenate([self.routes['sid_list'], new_sids])
+        origin = np.concatenate([np.zeros(len(self.routes), np.int8), np.ones(len(new.routes), np.int8)])
+
+        old_matched = np.zeros(len(self.routes), dtype=bool)
+        new_matched = np.zeros(len(new.routes), dtype=bool)
+        changed = np.zeros(len(new.routes), dtype=bool)
+        if len(combined) > 1:
+            order = np.lexsort((origin,) + tuple(combined[field] for field in reversed(KEY_FIELDS)))
+            pair = self._same_key(combined, order) & (origin[order[:-1]] == 0) & (origin[order[1:]] == 1)
+            old_idx = order[:-1][pair]
+            new_idx = order[1:][pair] - len(self.routes)
+            old_matched[old_idx] = True
+            new_matched[new_idx] = True
+            changed[new_idx[sids[old_idx] != new_sids[new_idx]]] = True
+
+        return new._subset(~new_matched), self._subset(~old_matched), new._subset(changed)
+
+    def __iter__(self):
+        """Yield (prefix, prefix_len, segs, table_id, peer) with strings built once per route"""
+        sid_lists, peers = self.sid_lists.values, self.peers.values
+        for table_id, version, prefix_len, hi, lo, sid_list, peer in self.routes.tolist():
+            yield (_format_prefix(version, prefix_len, hi, lo), prefix_len, list(sid_lists[sid_list]),
+                   table_id, peers[peer] if peer >= 0 else None)
@@ -0,0 +1,207 @@
+import os
+import socket
+import logging
+import platform
+import functools
+import ipaddress
+
+logger = logging.getLogger(__name__)
+
+# Default uSID format F3216: 32-bit locator block followed by 16-bit uSIDs
+USID_BLOCK_BITS = 32
+USID_BITS = 16
+
+# Address space holding uSID containers; SIDs outside it are classic SIDs
+USID_PREFIXES = 'fc00::/7,5f00::/16'
+
+# Header sizes in bytes
+IPV6_HEADER_LEN = 40
+SRH_FIXED_LEN = 8
+SID_LEN = 16
+
+# Inner IP + TCP header bytes, by IP version
+INNER_TCP_HEADER_LEN = {4: 20 + 20, 6: 40 + 20}
+
+# Minimum link MTU for IPv6 (RFC 8200)
+IPV6_MIN_MTU = 1280
+
+# Linux kernel release that added H.Encaps.Red (seg6 mode encap.red)
+ENCAP_RED_MIN_KERNEL = (6, 3)
+
+ENCAP_MODES = ('encap', 'encap.red')
+
+def expand_sid(sid):
+    """Expand a SID written with its trailing zero groups omitted to a full IPv6 address"""
+    # Keep only non-empty parts and let :: represent the remaining zeros
+    parts = [p for p in sid.rstrip(':').split(':') if p]
+    if len(parts) == 8:
+        return ':'.join(parts)
+    return ':'.join(parts) + '::'
+
+def get_dest_function(srv6_data=None):
+    """Get the destination function from the API response, falling back to DEST_FUNCTION"""
+    if srv6_data and 'srv6_endpoint_behavior' in srv6_data:
+        try:
+            # Convert to hex string if it's a number
+            return hex(int(srv6_data['srv6_endpoint_behavior']))[2:]
+        except (ValueError, TypeError):
+            pass
+    return os.getenv('DEST_FUNCTION') or None
+
+def get_sid_list(srv6_data, srv6_usid=None):
+    """Get the ordered SID list from API data; a single srv6_usid is a one-element list"""
+    sids = (srv6_data or {}).get('srv6_sid_list')
+    if sids:
+        if isinstance(sids, str):
+            sids = [s.strip() for s in sids.split(',') if s.strip()]
+        return list(sids)
+    usid = srv6_usid or (srv6_data or {}).get('srv6_usid')
+    return [usid] if usid else []
+
+def _parse_sid(sid):
+    """Parse a SID, accepting one written with its trailing zero groups omitted"""
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET6, sid), 'big')
+    except (OSError, TypeError):
+        return int(ipaddress.IPv6Address(expand_sid(sid)))
+
+@functools.lru_cache(maxsize=None)
+def _parse_usid_prefixes(prefixes):
+    return tuple(ipaddress.IPv6Network(p.strip()) for p in prefixes.split(',') if p.strip())
+
+@functools.lru_cache(maxsize=None)
+def _prefix_masks(prefixes):
+    """(network, netmask) integers of prefixes, for matching SIDs without ipaddress objects"""
+    return tuple((int(p.network_address), int(p.netmask)) for p in prefixes)
+
+def get_usid_prefixes():
+    """Get the uSID address space from SRV6_USID_PREFIXES (parsed once per value)"""
+    return _parse_usid_prefixes(os.environ.get('SRV6_USID_PREFIXES', USID_PREFIXES))
+
+def _split_container(sid, value, block_bits, usid_bits):
+    """Split a uSID container (given as an integer) into its locator block and the uSIDs after it"""
+    carrier_bits = 128 - block_bits
+    block = value >> carrier_bits
+    usids = []
+    # Walk the carrier from the most significant uSID until end-of-carrier (all zeros)
+    for shift in range(carrier_bits - usid_bits, -1, -usid_bits):
+        usid = (value >> shift) & ((1 << usid_bits) - 1)
+        if usid == 0:
+            if value & ((1 << shift) - 1):
+                raise ValueError(f"SID {sid} has bits set after its end-of-carrier")
+            break
+        usids.append(usid)
+    return block, usids
+
+def _pack_containers(block, usids, block_bits, usid_bits):
+    """Pack uSIDs densely into as few containers sharing one block as possible"""
+    carrier_bits = 128 - block_bits
+    per_container = carrier_bits // usid_bits
+    containers = []
+    for i in range(0, len(usids), per_container):
+        value = block << carrier_bits
+        shift = carrier_bits - usid_bits
+        for usid in usids[i:i + per_container]:
+            value |= usid << shift
+            shift -= usid_bits
+        containers.append(str(ipaddress.IPv6Address(value)))
+    return containers
+
+def compress_sid_list(sids, function=None, block_bits=USID_BLOCK_BITS, usid_bits=USID_BITS,
+                      usid_prefixes=None):
+    """Compress a SID list into the fewest uSID containers
+
+    Consecutive SIDs sharing a locator block have their uSIDs merged and
+    repacked densely; a change of block starts a new run. SIDs outside the
+    uSID address space are classic SIDs and are kept as they are. The
+    destination function, if any, is appended as the final uSID when the
+    last SID is a uSID container.
+    """
+    if usid_prefixes is None:
+        usid_prefixes = get_usid_prefixes()
+    masks = _prefix_masks(tuple(usid_prefixes))
+
+    # A run is (block, uSIDs) for uSID containers or (None, classic SID)
+    runs = []
+    for sid in sids:
+        value = _parse_sid(sid)
+        if not any(value & mask == network for network, mask in masks):
+            runs.append((None, str(ipaddress.IPv6Address(value))))
+            continue
+        block, usids = _split_container(sid, value, block_bits, usid_bits)
+        if runs and runs[-1][0] == block:
+            runs[-1][1].extend(usids)
+        else:
+            runs.append((block, list(usids)))
+
+    if not runs:
+        raise ValueError("SID list is empty")
+
+    if function and runs[-1][0] is not None:
+        usid = int(function, 16)
+        if not 0 < usid < 1 << usid_bits:
+            raise ValueError(f"Destination function {function} does not fit in a {usid_bits}-bit uSID")
+        runs[-1][1].append(usid)
+
+    containers = []
+    for block, usids in runs:
+        if block is None:
+            containers.append(usids)
+        elif usids:
+            containers.extend(_pack_containers(block, usids, block_bits, usid_bits))
+        else:
+            # A bare block is a SID in its own right, keep it as is
+            containers.append(str(ipaddress.IPv6Address(block << (128 - block_bits))))
+    return containers
+
+def build_segment_list(srv6_usid=None, srv6_data=None):
+    """Build the final, compressed segment list for a route"""
+    block_bits = int(os.environ.get('SRV6_USID_BLOCK_BITS', USID_BLOCK_BITS))
+    usid_bits = int(os.environ.get('SRV6_USID_BITS', USID_BITS))
+    sids = get_sid_list(srv6_data, srv6_usid)
+    return compress_sid_list(sids, get_dest_function(srv6_data), block_bits, usid_bits)
+
+def kernel_supports_encap_red(release=None):
+    """Check whether the running kernel supports seg6 encap.red"""
+    release = release or platform.release()
+    try:
+        version = tuple(int(p) for p in release.split('-')[0].split('.')[:2])
+    except ValueError:
+        return False
+    return version >= ENCAP_RED_MIN_KERNEL
+
+@functools.lru_cache(maxsize=None)
+def _warn_encap_red_fallback():
+    """Warn once that encap.red was requested but cannot be used"""
+    logger.warning(f"SRV6_ENCAP_MODE=encap.red is not supported here (needs Linux "
+                   f"{'.'.join(map(str, ENCAP_RED_MIN_KERNEL))} or later), falling back to encap")
+
+def get_encap_mode(supports_red=True):
+    """Get the encap mode from SRV6_ENCAP_MODE ('encap', 'encap.red' or 'auto')"""
+    mode = os.environ.get('SRV6_ENCAP_MODE', 'encap')
+    if mode == 'auto':
+        return 'encap.red' if supports_red else 'encap'
+    if mode not in ENCAP_MODES:
+        raise ValueError(f"Unsupported SRv6 encap mode: {mode}")
+    if mode == 'encap.red' and not supports_red:
+        _warn_encap_red_fallback()
+        return 'encap'
+    return mode
+
+def encap_overhead(segs, mode='encap'):
+    """Bytes added to each packet by SRv6 encapsulation with this segment list"""
+    nsegs = len(segs)
+    if mode == 'encap.red':
+        # The first SID only goes in the outer destination address
+        nsegs -= 1
+    if nsegs <= 0:
+        return IPV6_HEADER_LEN
+    return IPV6_HEADER_LEN + SRH_FIXED_LEN + SID_LEN * nsegs
+
+def inner_mtu(path_mtu, segs, mode='encap'):
+    """MTU left for the inner packet once the encapsulation is added"""
+    return path_mtu - encap_overhead(segs, mode)
+
+def route_advmss(path_mtu, segs, mode='encap', version=6):
+    """TCP MSS that fits in one encapsulated packet on a path with this MTU"""
+    return inner_mtu(path_mtu, segs, mode) - INNER_TCP_HEADER_LEN[version]
@@ -1,4 +1,5 @@
 import os
+import atexit
 import logging
 from dist_setup import init_distributed, get_all_nodes
 from controller import NetworkProgrammer
@@ -14,6 +15,8 @@ class DemoPlugin:
         """Initialize with the network API endpoint"""
         self.api_endpoint = api_endpoint
         self.network_programmer = NetworkProgrammer(api_endpoint)
+        self.nodes = []
+        self.comm_monitor = None
     
     def init_process_group(self, backend='gloo', **kwargs):
         """Initialize distributed training and program routes"""
@@ -28,13 +31,60 @@ class DemoPlugin:
             logger.info(" Getting node information...")
             nodes = get_all_nodes()
             
-            # Program routes
+            # Program routes: a restarted worker that recorded its routes in
+            # ROUTE_STATE_FILE only updates the membership delta, otherwise use a
+            # precompiled plan when one is available and current
             #logger.info("  Begin programming routes...")
-            self.network_programmer.program_all_routes(nodes)
+            plan_path = os.environ.get('ROUTE_PLAN_PATH')
+            if self.network_programmer.installed_routes:
+                self.network_programmer.update_routes(None, nodes)
+            elif not (plan_path and self.network_programmer.program_from_plan(plan_path, nodes)):
+                self.network_programmer.program_all_routes(nodes)
+            self.nodes = nodes
+            
+            # Monitor collectives for slow paths, if enabled
+            if int(os.environ.get('COMM_MONITOR_SAMPLE_EVERY', '0')) > 0:
+                self.enable_comm_monitor()
+            
+            # Start sampling per-peer traffic, if enabled
+            if self.network_programmer.traffic_collector:
+                self.network_programmer.traffic_collector.start()
+                # Flush the last samples to the export file and push endpoint
+                atexit.register(self.network_programmer.traffic_collector.stop)
             
             logger.info(" Initialization completed successfully")
             return True
             
         except Exception as e:
             logger.error(f"Error during initialization: {e}")
-            return False 
\ No newline at end of file
+            return False
+    
+    def enable_comm_monitor(self, **kwargs):
+        """Create a comm monitor that reprograms routes to persistently slow peers"""
+        from comm_monitor import CommMonitor
+        if not self.comm_monitor:
+            atexit.register(self._close_comm_monitor)
+        self.comm_monitor = CommMonitor(self.nodes, network_programmer=self.network_programmer, **kwargs)
+        return self.comm_monitor
+    
+    def _close_comm_monitor(self):
+        """Report at the end of the job"""
+        if self.comm_monitor:
+            self.comm_monitor.close()
+    
+    def update_membership(self, nodes=None):
+        """Update routes after an elastic membership change (e.g. a new rendezvous round)"""
+        try:
+            if nodes is None:
+                nodes = get_all_nodes()
+            
+            self.network_programmer.update_routes(self.nodes, nodes)
+            self.nodes = nodes
+            if self.comm_monitor:
+                self.comm_monitor.close()
+                self.enable_comm_monitor()
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error during membership update: {e}")
+            return False
@@ -0,0 +1,293 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+import ipaddress
+import requests
+from pyroute2 import IPRoute, NFCTSocket
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Lightweight tunnel encap type for seg6 routes (LWTUNNEL_ENCAP_SEG6)
+LWTUNNEL_ENCAP_SEG6 = 5
+
+class TrafficCollector:
+    """Sample per-peer traffic counters for our SRv6 routes via netlink bulk dumps
+
+    Conntrack counts every flow on the host, so the matrix row is this
+    host's traffic towards the job's peer prefixes: other jobs on the host
+    talking to the same peers are included. job_id only labels the samples.
+    """
+
+    def __init__(self, interface='eth1', table_id=254, job_id=None, interval=10.0):
+        """Initialize with the backend interface and the table holding our seg6 routes"""
+        self.interface = interface
+        self.table_id = table_id
+        self.interval = interval
+        self.job_id = job_id or os.environ.get(
+            'JOB_ID',
+            f"{os.environ.get('MASTER_ADDR', 'localhost')}:{os.environ.get('MASTER_PORT', '29500')}"
+        )
+        self.source = os.environ.get('HOSTNAME', socket.gethostname())
+
+        # Optional export/push targets
+        self.export_path = os.environ.get('TRAFFIC_EXPORT_PATH')
+        self.push_endpoint = os.environ.get('TRAFFIC_PUSH_ENDPOINT')
+        self.push_batch = int(os.environ.get('TRAFFIC_PUSH_BATCH', '6'))
+
+        self.iproute = IPRoute()
+        self.nfct = None
+        try:
+            self.nfct = NFCTSocket()
+        except Exception as e:
+            logger.warning(f"Conntrack unavailable, per-peer counters disabled: {e}")
+
+        # prefix -> peer hostname, filled in by the network programmer
+        self.peers = {}
+        # (net_int, mask_int, prefix_len, version, hostname) for seg6 routes present in the table
+        self._matchers = []
+
+        self._flow_counters = {}
+        self._link_counters = None
+        self._last_sample = None
+        self.matrix = {}
+        self.interface_rates = {}
+        self._pending = []
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def set_peers(self, peers):
+        """Set the prefix -> hostname mapping of routes programmed for this job"""
+        with self._lock:
+            self.peers = dict(peers)
+
+    def _refresh_matchers(self):
+        """Find which of our peer prefixes are installed as seg6 routes (one route dump)"""
+        installed = set()
+        for family in (socket.AF_INET6, socket.AF_INET):
+            for route in self.iproute.get_routes(family=family, table=self.table_id):
+                if route.get_attr('RTA_ENCAP_TYPE') != LWTUNNEL_ENCAP_SEG6:
+                    continue
+                dst = route.get_attr('RTA_DST')
+                if dst:
+                    installed.add(str(ipaddress.ip_network(f"{dst}/{route['dst_len']}", strict=False)))
+
+        matchers = []
+        for prefix, hostname in self.peers.items():
+            net = ipaddress.ip_network(prefix, strict=False)
+            if str(net) not in installed:
+                continue
+            matchers.append((int(net.network_address), int(net.netmask),
+                             net.prefixlen, net.version, hostname))
+        # Longest prefix first so the first match wins
+        matchers.sort(key=lambda m: m[2], reverse=True)
+        self._matchers = matchers
+
+    def _match_peer(self, daddr):
+        """Return the peer hostname whose prefix covers daddr, if any"""
+        try:
+            addr = ipaddress.ip_address(daddr)
+        except ValueError:
+            return None
+        value = int(addr)
+        for net_int, mask_int, _, version, hostname in self._matchers:
+            if version == addr.version and value & mask_int == net_int:
+                return hostname
+        return None
+
+    @staticmethod
+    def _tuple_daddr(tuple_attr):
+        """Destination address of a conntrack tuple"""
+        tuple_ip = tuple_attr.get_attr('CTA_TUPLE_IP') if tuple_attr else None
+        if not tuple_ip:
+            return None
+        return tuple_ip.get_attr('CTA_IP_V6_DST') or tuple_ip.get_attr('CTA_IP_V4_DST')
+
+    def _dump_flow_counters(self):
+        """Aggregate conntrack byte/packet deltas per peer (one conntrack dump)
+
+        Traffic we send to a peer is counted in the original direction of the
+        flows we opened (original destination in the peer's prefix) and in the
+        reply direction of the flows the peer opened (reply destination in
+        the peer's prefix), e.g. the side of a collective that accepted the
+        connection.
+        """
+        totals = {}
+        if not self.nfct:
+            return totals
+
+        seen = {}
+        for msg in self.nfct.dump():
+            flow_id = msg.get_attr('CTA_ID')
+            for direction, tuple_attr, counters_attr in (('orig', 'CTA_TUPLE_ORIG', 'CTA_COUNTERS_ORIG'),
+                                                         ('reply', 'CTA_TUPLE_REPLY', 'CTA_COUNTERS_REPLY')):
+                counters = msg.get_attr(counters_attr)
+                if not counters:
+                    continue
+                hostname = self._match_peer(self._tuple_daddr(msg.get_attr(tuple_attr)))
+                if not hostname:
+                    continue
+
+                key = (flow_id, direction)
+                nbytes = counters.get_attr('CTA_COUNTERS_BYTES') or 0
+                npackets = counters.get_attr('CTA_COUNTERS_PACKETS') or 0
+                seen[key] = (nbytes, npackets)
+
+                # Counters are cumulative per flow; only count what is new since the last dump
+                last_bytes, last_packets = self._flow_counters.get(key, (0, 0))
+                peer = totals.setdefault(hostname, {'bytes': 0, 'packets': 0})
+                peer['bytes'] += max(nbytes - last_bytes, 0)
+                peer['packets'] += max(npackets - last_packets, 0)
+                # A flow to a peer is counted in one direction only
+                break
+
+        # Forget flows that expired
+        self._flow_counters = seen
+        return totals
+
+    def _dump_link_counters(self):
+        """Read backend interface counters (one link dump)"""
+        for link in self.iproute.get_links():
+            if link.get_attr('IFLA_IFNAME') != self.interface:
+                continue
+            stats = link.get_attr('IFLA_STATS64')
+            if not stats:
+                return None
+            return {
+                'tx_bytes': stats['tx_bytes'],
+                'tx_packets': stats['tx_packets'],
+                'rx_bytes': stats['rx_bytes'],
+                'rx_packets': stats['rx_packets']
+            }
+        return None
+
+    def sample(self):
+        """Take one sample and update the traffic matrix row for this host"""
+        with self._lock:
+            now = time.time()
+            elapsed = now - self._last_sample if self._last_sample else None
+            self._last_sample = now
+
+            try:
+                self._refresh_matchers()
+                flows = self._dump_flow_counters()
+                link = self._dump_link_counters()
+            except Exception as e:
+                logger.error(f"Traffic sampling failed: {e}")
+                return None
+
+            row = self.matrix.setdefault(self.source, {})
+            for hostname, counters in flows.items():
+                cell = row.setdefault(hostname, {'bytes': 0, 'packets': 0, 'bps': 0.0})
+                cell['bytes'] += counters['bytes']
+                cell['packets'] += counters['packets']
+                cell['bps'] = counters['bytes'] * 8 / elapsed if elapsed else 0.0
+            # Peers that went quiet this interval
+            for hostname, cell in row.items():
+                if hostname not in flows:
+                    cell['bps'] = 0.0
+
+            if link and self._link_counters and elapsed:
+                self.interface_rates = {
+                    key: (link[key] - self._link_counters[key]) / elapsed for key in link
+                }
+            if link:
+                self._link_counters = link
+
+            record = {
+                'job_id': self.job_id,
+                'timestamp': now,
+                'source': self.source,
+                'interface': self.interface,
+                'interface_rates': dict(self.interface_rates),
+                'peers': {h: dict(c) for h, c in row.items()}
+            }
+            self._pending.append(record)
+
+        self.export()
+        if len(self._pending) >= self.push_batch:
+            self.push()
+        return record
+
+    def demand(self):
+        """Return measured demand in bits per second per peer hostname"""
+        with self._lock:
+            row = self.matrix.get(self.source, {})
+            return {hostname: cell['bps'] for hostname, cell in row.items()}
+
+    def export(self, path=None):
+        """Write the current traffic matrix to a local JSON file"""
+        path = path or self.export_path
+        if not path:
+            return False
+        with self._lock:
+            data = {
+                'job_id': self.job_id,
+                'timestamp': self._last_sample,
+                'interface_rates': self.interface_rates,
+                'matrix': self.matrix
+            }
+        try:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to export traffic matrix to {path}: {e}")
+            return False
+
+    def push(self):
+        """Push pending samples to the traffic endpoint in one batch"""
+        if not self.push_endpoint:
+            self._pending = []
+            return False
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return True
+        try:
+            response = requests.post(self.push_endpoint, json={'job_id': self.job_id, 'samples': batch},
+                                     timeout=5)
+            response.raise_for_status()
+            return True
+        except Exception as e:
+            logger.error(f"Failed to push traffic samples to {self.push_endpoint}: {e}")
+            # Keep the samples for the next attempt, bounded to a few batches
+            with self._lock:
+                self._pending = (batch + self._pending)[-self.push_batch * 4:]
+            return False
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        """Start sampling in a background thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self.sample()
+        self._thread = threading.Thread(target=self._run, name='traffic-collector', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and flush pending samples"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval)
+            self._thread = None
+        self.export()
+        self.push()
+
+    def __del__(self):
+        if hasattr(self, 'iproute'):
+            self.iproute.close()
+        if getattr(self, 'nfct', None):
+            self.nfct.close()